@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+
+"""Parity and cost of the NumPy-only ask-to-ask student against the spaCy model it was distilled
+from.
+
+Parity: both score the eval set (textcat_demo/assets/data.jsonl, the project's dev set, which the
+student is not distilled on), and the student must make A2AFilter's decision (BAD * 100 > GOOD) the same way on at least --min-agreement
+of the messages; --check exits with status 1 otherwise. Cost: each backend is loaded in a fresh
+process, which reports how long loading took, how much it grew the process's RSS, and the time per
+message when scoring the corpora in batches of 32, as the BatchClassifier does. Last, the student is
+run through the BatchClassifier the way the bot runs it with NANO_A2A_BACKEND=student, which must
+give the same scores as calling it directly and answer repeats from its cache.
+
+Run it from anywhere:    python bench/a2a_student.py [--check]
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+from pathlib import Path
+import numpy as np
+
+ROOT = Path(__file__).resolve().parent.parent
+os.chdir(ROOT)
+sys.path.insert(0, str(ROOT / "src"))
+import a2a_student
+from constants import A2A_MODEL
+
+BATCH = 32
+
+
+def decisions(cats):
+    return np.array([c["BAD"] * 100 > c["GOOD"] for c in cats])
+
+
+def parity(min_agreement):
+    """Compares the student with the model on the eval set, returning whether it agrees often
+    enough."""
+    import spacy
+
+    student_model = a2a_student.StudentClassifier()
+    if student_model.meta["source"] != "teacher":
+        print("The student was fit to the eval set's labels, so it can't be compared on it")
+        return False
+    texts = a2a_student.eval_texts()
+    a2a_nlp = spacy.load(A2A_MODEL)
+    teacher = [a2a_nlp(text).cats for text in texts]
+    student = student_model.cats(texts)
+    agreement = (decisions(teacher) == decisions(student)).mean()
+    bad_error = np.abs([t["BAD"] - s["BAD"] for t, s in zip(teacher, student)])
+    print(f"{len(texts)} eval messages, none of them distilled on")
+    print(f"same decision as the model on {agreement:.1%}")
+    print(f"BAD score error: mean {bad_error.mean():.4f}, max {bad_error.max():.4f}")
+    return agreement >= min_agreement
+
+
+def rss_mb():
+    """The process's current resident set size, on Linux."""
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * resource.getpagesize() / 2 ** 20
+
+
+def measure(backend):
+    """Loads backend and scores the corpora with it, printing what it cost as JSON."""
+    texts = a2a_student.corpus_texts()
+    rss = rss_mb()
+    start = time.perf_counter()
+    if backend == "spacy":
+        import spacy
+
+        a2a_nlp = spacy.load(A2A_MODEL)
+
+        def score(batch):
+            return [doc.cats for doc in a2a_nlp.pipe(batch, batch_size=BATCH)]
+
+    else:
+        student = a2a_student.StudentClassifier()
+        score = student.cats
+    load_seconds = time.perf_counter() - start
+    # the first batch pays for lazy initialization in both
+    score(texts[:BATCH])
+    start = time.perf_counter()
+    for i in range(0, len(texts), BATCH):
+        score(texts[i : i + BATCH])
+    per_text = (time.perf_counter() - start) / len(texts)
+    print(
+        json.dumps(
+            {
+                "backend": backend,
+                "load_ms": load_seconds * 1000,
+                "rss_growth_mb": rss_mb() - rss,
+                "ms_per_message": per_text * 1000,
+                "messages": len(texts),
+            }
+        )
+    )
+
+
+def through_classifier():
+    """Classifies part of the eval set with the student behind a BatchClassifier twice, printing
+    whether it matched the student's own scores each time as JSON."""
+    import asyncio
+    from a2a import BatchClassifier
+    from cache import TTLCache
+    from workers import WorkerPool
+
+    texts = a2a_student.eval_texts()[:200]
+    expected = a2a_student.StudentClassifier().cats(texts)
+
+    async def classify_all(classifier):
+        return await asyncio.gather(*(classifier.classify(text) for text in texts))
+
+    async def run():
+        classifier = BatchClassifier(WorkerPool(0, 64, "wait"), cache=TTLCache(maxsize=4096))
+        first = await classify_all(classifier)
+        cached = classifier.stats()["size"]
+        second = await classify_all(classifier)
+        return first, second, cached
+
+    first, second, cached = asyncio.run(run())
+    # texts that normalize the same share a score, so compare decisions rather than exact scores
+    print(
+        json.dumps(
+            {
+                "messages": len(texts),
+                "cached": cached,
+                "first_agreement": float((decisions(first) == decisions(expected)).mean()),
+                "second_agreement": float((decisions(second) == decisions(expected)).mean()),
+            }
+        )
+    )
+
+
+def pipeline():
+    """Runs through_classifier in a process that has NANO_A2A_BACKEND=student, returning whether
+    it went through."""
+    result = subprocess.run(
+        [sys.executable, __file__, "--through-classifier"],
+        capture_output=True,
+        text=True,
+        env={**os.environ, "NANO_A2A_BACKEND": "student"},
+    )
+    if result.returncode != 0:
+        print(f"BatchClassifier: failed\n{result.stderr.strip().splitlines()[-1]}")
+        return False
+    r = json.loads(result.stdout.strip().splitlines()[-1])
+    print(
+        f"BatchClassifier: {r['messages']} messages, {r['cached']} cached, same decisions as the "
+        f"student on {r['first_agreement']:.1%} and {r['second_agreement']:.1%} from the cache"
+    )
+    return r["first_agreement"] == r["second_agreement"] == 1
+
+
+def cost():
+    for backend in ("student", "spacy"):
+        result = subprocess.run(
+            [sys.executable, __file__, "--measure", backend], capture_output=True, text=True
+        )
+        if result.returncode != 0:
+            print(f"{backend}: failed\n{result.stderr.strip().splitlines()[-1]}")
+            continue
+        r = json.loads(result.stdout.strip().splitlines()[-1])
+        print(
+            f"{backend}: loads in {r['load_ms']:.1f} ms, grows RSS by {r['rss_growth_mb']:.1f} MB, "
+            f"{r['ms_per_message']:.3f} ms per message over {r['messages']} messages"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--check", action="store_true", help="exit 1 if parity falls short")
+    parser.add_argument("--min-agreement", type=float, default=0.99)
+    parser.add_argument("--measure", choices=("spacy", "student"), help=argparse.SUPPRESS)
+    parser.add_argument("--through-classifier", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.measure:
+        measure(args.measure)
+        return
+    if args.through_classifier:
+        through_classifier()
+        return
+    try:
+        ok = parity(args.min_agreement)
+    except OSError as e:
+        print(f"Could not compare with {A2A_MODEL}: {e}")
+        ok = False
+    print()
+    cost()
+    print()
+    ok = pipeline() and ok
+    if args.check and not ok:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
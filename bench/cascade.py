@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+
+"""Evaluates the two-stage ask-to-ask cascade against the current filter (the spaCy model alone).
+
+On the labelled messages, each is scored by a scorer fit without its fold, so the figures are out of
+sample; messages the scorer escalates get the model's decision. Reports the fraction escalated, the
+accuracy of the model alone and of the cascade, how often they disagree, and the time each stage
+takes. Then reports the fraction escalated over the scraped corpora: every message posted within
+five minutes of its author joining, which is all A2AFilter ever sees.
+
+Run it from anywhere:    python bench/cascade.py
+"""
+import argparse
+import csv
+import datetime
+import os
+import sys
+import time
+from pathlib import Path
+import numpy as np
+
+ROOT = Path(__file__).resolve().parent.parent
+CORPORA = ["messages.csv", "data.csv", "hour.csv", "test.csv"]
+# the training data and the model are found relative to the repository root, so paths given on the
+# command line are resolved against where it was run from
+CWD = Path.cwd()
+os.chdir(ROOT)
+sys.path.insert(0, str(ROOT / "src"))
+import cascade
+from constants import A2A_MODEL
+
+
+def model_verdicts(texts):
+    """A2AFilter's decision on each text with the model alone, and seconds per text, or None if
+    the model can't be loaded."""
+    try:
+        import spacy
+
+        nlp = spacy.load(A2A_MODEL)
+    except Exception as e:
+        print(f"Could not load {A2A_MODEL} ({e}), so there is no model to compare with")
+        return None, None
+    start = time.perf_counter()
+    cats = [doc.cats for doc in nlp.pipe([text.lower() for text in texts])]
+    elapsed = (time.perf_counter() - start) / len(texts)
+    return np.array([c["BAD"] * 100 > c["GOOD"] for c in cats]), elapsed
+
+
+def labelled():
+    examples = cascade.training_data()
+    x = cascade.design(examples)
+    y = np.array([a2a for *_, a2a in examples])
+    scores = cascade.out_of_fold_scores(x, y)
+    reject_below, accept_at_least = cascade.calibrate(scores, y)
+    verdicts = np.full(len(y), -1)
+    verdicts[scores < reject_below] = 0
+    if accept_at_least is not None:
+        verdicts[scores >= accept_at_least] = 1
+    escalated = verdicts == -1
+    print(f"{len(y)} labelled messages, {y.sum()} ask-to-ask")
+    print(f"escalated to the model: {escalated.mean():.1%}")
+    print(f"wrongly decided by the scorer: {(verdicts[~escalated] != y[~escalated]).sum()}")
+
+    model, model_seconds = model_verdicts([text for text, *_ in examples])
+    if model is not None:
+        combined = np.where(escalated, model, verdicts == 1)
+        print(f"model alone: accuracy {(model == y).mean():.1%}")
+        print(f"cascade:     accuracy {(combined == y).mean():.1%}")
+        print(f"cascade disagrees with the model alone on {(combined != model).sum()} messages")
+        print(f"model: {model_seconds * 1000:.3f} ms per message")
+
+    scorer = cascade.CascadeScorer()
+    start = time.perf_counter()
+    for text, posted_relative, num_prev, _ in examples:
+        scorer.decide(text, posted_relative, num_prev)
+    elapsed = (time.perf_counter() - start) / len(examples)
+    print(f"scorer: {elapsed * 1000:.3f} ms per message")
+
+
+def traffic(paths):
+    """Fraction of the messages A2AFilter would see that the built scorer escalates."""
+    scorer = cascade.CascadeScorer()
+    rows = {}
+    for path in paths:
+        with open(path, newline="", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                if row["author_joined"] and row["content"]:
+                    rows[(row["created"], row["author"], row["content"])] = row
+    rows = sorted(rows.values(), key=lambda row: row["created"])
+    seen = {}
+    decisions = []
+    for row in rows:
+        created = datetime.datetime.fromisoformat(row["created"])
+        joined = datetime.datetime.fromisoformat(row["author_joined"])
+        posted_relative = (created - joined).total_seconds() / 60
+        if not 0 <= posted_relative < cascade.MAX_POSTED_RELATIVE:
+            continue
+        num_prev = seen.get(row["author"], 0)
+        seen[row["author"]] = num_prev + 1
+        decisions.append(scorer.decide(row["content"], posted_relative, num_prev))
+    if decisions:
+        escalated = sum(d is None for d in decisions) / len(decisions)
+        print(f"{len(decisions)} messages from new members in {', '.join(p.name for p in paths)}")
+        print(f"escalated to the model: {escalated:.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("paths", nargs="*", type=Path, default=[ROOT / path for path in CORPORA])
+    args = parser.parse_args()
+    args.paths = [CWD / path for path in args.paths]
+    labelled()
+    print()
+    traffic(args.paths)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+
+"""Local stand-in for the Open Trivia Database, for trying out the trivia cog without touching
+opentdb. It serves a fixed number of generated questions per category and difficulty and implements
+opentdb's session tokens: each token gets every question once (response code 4 once it has had
+them all, until it is reset), and forgetting a token (--token-lifetime) makes it answer code 3.
+
+Serve it to a running bot:   python bench/fake_opentdb.py --port 8765
+                             NANO_TRIVIA_URL=http://localhost:8765 python src/bot.py
+Exercise QuestionPool:       python bench/fake_opentdb.py --check
+"""
+import argparse
+import asyncio
+import sys
+import time
+import uuid
+from pathlib import Path
+
+from aiohttp import web
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+
+class FakeOpenTDB:
+    def __init__(self, questions=120, token_lifetime=None, min_interval=0.0):
+        self.questions = questions
+        self.token_lifetime = token_lifetime
+        self.min_interval = min_interval
+        self.tokens = {}  # token -> (created, set of question ids served)
+        self.last_request = 0.0
+        self.requests = []
+
+    def question(self, category, difficulty, i):
+        return {
+            "category": str(category),
+            "type": "multiple",
+            "difficulty": difficulty or "medium",
+            "question": f"Question {i} of category {category} ({difficulty})?",
+            "correct_answer": f"right {i}",
+            "incorrect_answers": [f"wrong {i}.{j}" for j in range(3)],
+        }
+
+    def rate_limited(self):
+        now = time.monotonic()
+        limited = now - self.last_request < self.min_interval
+        self.last_request = now
+        return limited
+
+    def live_token(self, token):
+        entry = self.tokens.get(token)
+        if entry is None:
+            return None
+        if self.token_lifetime is not None and time.monotonic() - entry[0] > self.token_lifetime:
+            del self.tokens[token]
+            return None
+        return entry[1]
+
+    async def api_token(self, request):
+        command = request.query.get("command")
+        self.requests.append(("token", command))
+        if self.rate_limited():
+            return web.json_response({"response_code": 5})
+        if command == "request":
+            token = uuid.uuid4().hex
+            self.tokens[token] = (time.monotonic(), set())
+            return web.json_response({"response_code": 0, "token": token})
+        token = request.query.get("token")
+        if command == "reset" and self.live_token(token) is not None:
+            self.tokens[token] = (time.monotonic(), set())
+            return web.json_response({"response_code": 0, "token": token})
+        return web.json_response({"response_code": 3, "token": ""})
+
+    async def api(self, request):
+        query = request.query
+        self.requests.append(("api", dict(query)))
+        if self.rate_limited():
+            return web.json_response({"response_code": 5, "results": []})
+        try:
+            amount = int(query["amount"])
+        except (KeyError, ValueError):
+            return web.json_response({"response_code": 2, "results": []})
+        category = query.get("category", "any")
+        difficulty = query.get("difficulty")
+        ids = [(category, difficulty, i) for i in range(self.questions)]
+        if "token" not in query:
+            if amount > len(ids):
+                return web.json_response({"response_code": 1, "results": []})
+            return web.json_response(
+                {"response_code": 0, "results": [self.question(*q) for q in ids[:amount]]}
+            )
+        served = self.live_token(query["token"])
+        if served is None:
+            return web.json_response({"response_code": 3, "results": []})
+        unseen = [q for q in ids if q not in served]
+        if not unseen:
+            return web.json_response({"response_code": 4, "results": []})
+        if amount > len(unseen):
+            return web.json_response({"response_code": 1, "results": []})
+        served.update(unseen[:amount])
+        return web.json_response(
+            {"response_code": 0, "results": [self.question(*q) for q in unseen[:amount]]}
+        )
+
+    def app(self):
+        app = web.Application()
+        app.router.add_get("/api.php", self.api)
+        app.router.add_get("/api_token.php", self.api_token)
+        return app
+
+
+async def serve(server, host, port):
+    runner = web.AppRunner(server.app())
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    return runner
+
+
+async def check():
+    """Drives a QuestionPool against the stand-in through refills, token exhaustion and token
+    expiry, printing what happened at each step."""
+    from cogs.trivia import QuestionPool
+    from net import http
+
+    server = FakeOpenTDB(questions=30, token_lifetime=None)
+    runner = await serve(server, "127.0.0.1", 0)
+    port = runner.addresses[0][1]
+    pool = QuestionPool(f"http://127.0.0.1:{port}", batch=10, low_water=4, requests_per_second=100)
+
+    def api_calls():
+        return sum(kind == "api" for kind, _ in server.requests)
+
+    first = await pool.get()
+    assert first is not None
+    print(f"cold get: {api_calls()} api request(s), buffer {len(pool.buffers[None, None])}")
+
+    start = time.perf_counter()
+    for _ in range(5):
+        assert await pool.get() is not None
+    hot = (time.perf_counter() - start) / 5
+    await asyncio.sleep(0.1)
+    print(f"hot gets: {hot * 1e6:.0f} us each, {api_calls()} api request(s) so far")
+
+    seen = set()
+    for _ in range(60):
+        q = await pool.get()
+        assert q is not None
+        seen.add(q["question"])
+        await asyncio.sleep(0)
+    resets = sum(req == ("token", "reset") for req in server.requests)
+    print(f"60 more questions, {len(seen)} distinct, token resets {resets}")
+    assert resets >= 1
+
+    server.tokens.clear()
+    pool.buffers[None, None].clear()
+    assert await pool.get() is not None
+    renewals = sum(req == ("token", "request") for req in server.requests)
+    print(f"after the server forgot the token: token requests {renewals}")
+    assert renewals == 2
+
+    assert await pool.get(9, "hard") is not None
+    print(f"category 9, hard: buffer {len(pool.buffers[9, 'hard'])}")
+
+    await http.close()
+    await runner.cleanup()
+    print("ok")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--questions", type=int, default=120)
+    parser.add_argument("--token-lifetime", type=float, default=None)
+    parser.add_argument("--min-interval", type=float, default=0.0)
+    parser.add_argument("--check", action="store_true")
+    args = parser.parse_args()
+
+    if args.check:
+        asyncio.run(check())
+        return
+    server = FakeOpenTDB(args.questions, args.token_lifetime, args.min_interval)
+    web.run_app(server.app(), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+
+"""Benchmark of the deterministic n-gram language detector against langdetect on the scraped
+corpora: latency per message, agreement on the most probable language, agreement on which messages
+ForeignLangFilter would translate, and whether repeated runs give the same answers.
+
+    python bench/langid.py [CSV...] [--threshold 0.99 0.9 ...]
+"""
+import argparse
+import csv
+import re
+import statistics
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "src"))
+from langid import NgramLanguageModel
+
+# a few messages that really aren't English, as the corpora have next to none
+FOREIGN = [
+    "¿Alguien sabe cómo hacer esta tarea de matemáticas? no entiendo nada",
+    "je ne sais pas comment faire cet exercice, est-ce que quelqu'un peut m'aider",
+    "Kann mir jemand bei dieser Aufgabe helfen? Ich verstehe das nicht",
+    "ik weet niet hoe ik dit moet doen, kan iemand mij helpen met wiskunde",
+    "alguém sabe como resolver essa questão de física? não consigo",
+    "qualcuno sa come fare questo esercizio di matematica per domani",
+    "ada yang tahu cara mengerjakan soal ini? saya tidak mengerti sama sekali",
+    "no sé si es la respuesta correcta pero es lo que me salió en el examen",
+    "was ist das für eine Frage, das ist doch so einfach oder nicht",
+    "Кто-нибудь знает как решить эту задачу по математике",
+    "この問題の解き方を知っている人はいますか",
+    "bu soruyu nasıl çözeceğimi bilmiyorum yardım eder misiniz",
+    "czy ktoś wie jak rozwiązać to zadanie z matematyki na jutro",
+]
+
+
+def load(paths):
+    """Distinct messages ForeignLangFilter would run detection on."""
+    texts = []
+    for path in paths:
+        with open(path, newline="", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                content = row["content"]
+                if (
+                    len(content) > 30
+                    and not content.startswith("Nano, ")
+                    and not re.search(r"\d{8}", content)
+                ):
+                    texts.append(content)
+    return list(dict.fromkeys(texts))
+
+
+def timed(detect, texts):
+    results = []
+    times = []
+    for text in texts:
+        start = time.perf_counter()
+        try:
+            results.append(detect(text))
+        except Exception:
+            results.append([])
+        times.append(time.perf_counter() - start)
+    return results, times
+
+
+def flagged(langs, threshold):
+    """ForeignLangFilter's rule: not most probably English, and confidently something else."""
+    if langs and langs[0].lang == "en":
+        return False
+    return any(lang.lang != "en" and lang.prob > threshold for lang in langs)
+
+
+def latency(times):
+    times = sorted(times)
+    return (
+        f"mean {statistics.mean(times) * 1e3:.3f} ms, "
+        f"p50 {times[len(times) // 2] * 1e3:.3f} ms, "
+        f"p99 {times[int(len(times) * 0.99)] * 1e3:.3f} ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "paths", nargs="*", default=[str(ROOT / "messages.csv"), str(ROOT / "data.csv")]
+    )
+    parser.add_argument("--threshold", type=float, nargs="+", default=[0.99, 0.9, 0.8])
+    args = parser.parse_args()
+
+    from langdetect import DetectorFactory, detect_langs
+
+    texts = load(args.paths)
+    everything = texts + FOREIGN
+    print(f"{len(texts)} corpus messages, {len(FOREIGN)} foreign samples")
+
+    detect_langs("warm up the profiles")
+    runs = []
+    for seed in (None, None, 0):
+        DetectorFactory.seed = seed
+        runs.append(timed(detect_langs, everything))
+    (ld, ld_times), (ld_again, _), (ld_seeded, _) = runs
+
+    model = NgramLanguageModel()
+    model.detect("warm up the table")
+    ng, ng_times = timed(model.detect, everything)
+    ng_again, _ = timed(model.detect, everything)
+
+    def top(langs):
+        return langs[0].lang if langs else None
+
+    print(f"langdetect: {latency(ld_times)}")
+    print(f"n-gram:     {latency(ng_times)}")
+    print(f"speedup:    {statistics.mean(ld_times) / statistics.mean(ng_times):.1f}x")
+    unstable = sum(
+        [(l.lang, round(l.prob, 6)) for l in a] != [(l.lang, round(l.prob, 6)) for l in b]
+        for a, b in zip(ld, ld_again)
+    )
+    print(f"langdetect results differing between two unseeded runs: {unstable}")
+    print(f"n-gram results differing between two runs: {sum(a != b for a, b in zip(ng, ng_again))}")
+    n = len(texts)
+    agree = sum(top(a) == top(b) for a, b in zip(ld_seeded[:n], ng[:n]))
+    print(f"top language agreement, corpus: {agree}/{n} ({agree / n:.1%})")
+    agree = sum(top(a) == top(b) for a, b in zip(ld_seeded[n:], ng[n:]))
+    print(f"top language agreement, foreign samples: {agree}/{len(FOREIGN)}")
+    for threshold in args.threshold:
+        ld_flags = [flagged(langs, 0.99) for langs in ld_seeded]
+        ng_flags = [flagged(langs, threshold) for langs in ng]
+        print(
+            f"translated at n-gram threshold {threshold}: "
+            f"corpus {sum(ng_flags[:n])} (langdetect at 0.99: {sum(ld_flags[:n])}), "
+            f"foreign {sum(ng_flags[n:])}/{len(FOREIGN)} "
+            f"(langdetect: {sum(ld_flags[n:])}), "
+            f"same decision {sum(a == b for a, b in zip(ld_flags, ng_flags))}/{len(everything)}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+
+"""Micro-benchmark of the Merriam-Webster renderer over recorded API responses, comparing it with
+the previous regex-based mw_to_markdown and recursive get_all_senses.
+
+Record responses (needs MW_DICT_KEY):  python bench/mw_render.py --record set run take go
+Run the benchmark:                     python bench/mw_render.py
+
+The responses committed in bench/corpus/mw are synthetic-*.json, written by --synthesize: made-up
+entries in the shape of the Collegiate API's (sseq trees of sense and bs nodes, dt text, et) with
+the markup the API uses, sized like its largest answers. Recorded responses sit alongside them and
+are benchmarked together.
+"""
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import timeit
+import urllib.request
+from pathlib import Path
+from urllib.parse import quote
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+from cogs.mw import BASEURL, TOKEN_TO_FUNC, mw_to_markdown, replace_mw_punctuation
+from cogs.mw_cog import get_all_senses
+
+CORPUS = Path(__file__).resolve().parent / "corpus" / "mw"
+
+LEGACY_GROUP_RE = re.compile(r"{(.+?)}(.*?){\/.*?}")
+
+
+def legacy_mw_to_markdown(text):
+    new_text = replace_mw_punctuation(text)
+
+    def replace(match):
+        if match.group(1) in TOKEN_TO_FUNC:
+            return TOKEN_TO_FUNC[match.group(1)](match.group(2))
+        else:
+            return ""
+
+    subbed = re.sub(LEGACY_GROUP_RE, replace, new_text)
+    return re.sub(r"{[^}|]+\|([^}|]*)[^}]*}", r"\1", subbed)
+
+
+def legacy_get_all_senses(tree):
+    senses = []
+    if isinstance(tree, list):
+        if len(tree) == 2 and tree[0] == "sense":
+            senses.append(tree)
+        elif len(tree) == 2 and tree[0] == "bs":
+            _, sense_dict = tree
+            if "sense" in sense_dict:
+                senses.append(["sense", sense_dict["sense"]])
+        else:
+            for el in tree:
+                senses += legacy_get_all_senses(el)
+    elif isinstance(tree, dict):
+        for value in tree.values():
+            senses += legacy_get_all_senses(value)
+    return senses
+
+
+def record(words):
+    CORPUS.mkdir(parents=True, exist_ok=True)
+    for word in words:
+        url = BASEURL.format(quote(word), os.environ["MW_DICT_KEY"])
+        with urllib.request.urlopen(url) as r:
+            (CORPUS / f"{word}.json").write_bytes(r.read())
+        print(f"Recorded {word}")
+
+
+# the markup in definition text: the simple tags the renderer handles, the single tokens it keeps
+# the first field of, ones it drops, and punctuation
+SYNTHETIC_MARKUP = [
+    "{{it}}{0}{{/it}}",
+    "{{b}}{0}{{/b}}",
+    "{{sc}}{0}{{/sc}}",
+    "{{wi}}{0}{{/wi}}",
+    "{{gloss}}{0}{{/gloss}}",
+    "{{phrase}}{0}{{/phrase}}",
+    "{{qword}}{0}{{/qword}}",
+    "H{{inf}}2{{/inf}}O",
+    "x{{sup}}2{{/sup}}",
+    "{{sx|{0}||}}",
+    "{{a_link|{0}}}",
+    "{{d_link|{0}|{0}:2}}",
+    "{{dx}}see {{dxt|{0}||}}{{/dx}}",
+    "{{ldquo}}{0}{{rdquo}}",
+    "{{it}}a {{b}}{0}{{/b}}{{/it}}",
+]
+SYNTHETIC_WORDS = "place fix put lay stand hold become cause start move keep firm ready rule".split()
+
+
+def synthetic_text(rng):
+    words = [rng.choice(SYNTHETIC_WORDS) for _ in range(rng.randrange(4, 12))]
+    for _ in range(rng.randrange(1, 4)):
+        i = rng.randrange(len(words))
+        if "{" not in words[i]:
+            words[i] = rng.choice(SYNTHETIC_MARKUP).format(words[i])
+    return "{bc}" + " ".join(words)
+
+
+def synthetic_sense(rng, sn):
+    dt = [["text", synthetic_text(rng)]]
+    if rng.random() < 0.5:
+        dt.append(["vis", [{"t": synthetic_text(rng)} for _ in range(rng.randrange(1, 3))]])
+    return {"sn": sn, "dt": dt}
+
+
+def synthetic_entry(rng, word, homograph, senses):
+    """One entry with about senses senses, numbered and lettered like the API's."""
+    sseq = []
+    n = 1
+    while senses > 0:
+        letters = rng.randrange(1, 4)
+        group = []
+        for j in range(letters):
+            sn = f"{n} {'abc'[j]}" if letters > 1 else str(n)
+            node = ["bs", {"sense": synthetic_sense(rng, sn)}] if j == 0 and letters > 1 else None
+            group.append(node or ["sense", synthetic_sense(rng, sn)])
+        sseq.append(group)
+        senses -= letters
+        n += 1
+    return {
+        "meta": {"id": f"{word}:{homograph}", "stems": [word]},
+        "hwi": {"hw": word, "prs": [{"mw": word}]},
+        "fl": rng.choice(["verb", "noun", "adjective"]),
+        "def": [{"sseq": sseq}],
+        "et": [["text", f"Middle English {{it}}{word}en{{/it}}, from Old English {{it}}{word}{{/it}}"]],
+        "shortdef": [synthetic_text(rng)],
+    }
+
+
+def synthesize(words):
+    """Writes a made-up response for each word, with more entries and senses for shorter words,
+    which like "set" and "run" have the most."""
+    CORPUS.mkdir(parents=True, exist_ok=True)
+    for word in words:
+        rng = random.Random(word)
+        size = max(1, 8 - len(word))
+        entries = [
+            synthetic_entry(rng, word, i + 1, rng.randrange(10, 25) * size) for i in range(size)
+        ]
+        (CORPUS / f"synthetic-{word}.json").write_text(json.dumps(entries))
+        print(f"Synthesized {word}: {len(entries)} entries")
+
+
+def markup_strings(tree):
+    """Every string in the response that contains markup."""
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, str):
+            if "{" in node:
+                yield node
+        elif isinstance(node, list):
+            stack.extend(node)
+        elif isinstance(node, dict):
+            stack.extend(node.values())
+
+
+def bench(fn, args, number):
+    best = min(timeit.repeat(lambda: [fn(a) for a in args], number=number, repeat=5))
+    return best / number
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--record", nargs="+", metavar="WORD")
+    parser.add_argument("--synthesize", nargs="+", metavar="WORD")
+    parser.add_argument("--number", type=int, default=20)
+    args = parser.parse_args()
+    if args.record:
+        record(args.record)
+        return
+    if args.synthesize:
+        synthesize(args.synthesize)
+        return
+
+    responses = [json.loads(p.read_text()) for p in sorted(CORPUS.glob("*.json"))]
+    if not responses:
+        sys.exit(f"No responses in {CORPUS}, record some with --record or --synthesize first")
+    strings = [s for r in responses for s in markup_strings(r)]
+    defs = [e["def"] for r in responses for e in r if isinstance(e, dict) and "def" in e]
+
+    differing = [s for s in strings if legacy_mw_to_markdown(s) != mw_to_markdown(s)]
+    print(f"{len(responses)} responses, {len(strings)} markup strings, {len(defs)} entries")
+    print(f"{len(differing)} strings render differently from the legacy renderer")
+    for s in differing[:5]:
+        print(f"  {s!r}\n    legacy: {legacy_mw_to_markdown(s)!r}\n    new:    {mw_to_markdown(s)!r}")
+
+    rows = [
+        ("mw_to_markdown", legacy_mw_to_markdown, mw_to_markdown, strings),
+        ("get_all_senses", legacy_get_all_senses, get_all_senses, defs),
+    ]
+    for name, legacy, new, inputs in rows:
+        t_legacy = bench(legacy, inputs, args.number)
+        t_new = bench(new, inputs, args.number)
+        print(
+            f"{name}: legacy {t_legacy * 1e3:.3f} ms, new {t_new * 1e3:.3f} ms "
+            f"({t_legacy / t_new:.2f}x)"
+        )
+
+
+if __name__ == "__main__":
+    main()
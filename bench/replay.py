@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+
+"""Offline replay of the scraped corpora through the bot's message filters: the exact filter tuple
+OwnerCommands builds, driven through OwnerCommands.on_message, with Discord and translation stubbed
+out. Reports throughput, per-filter latency, peak memory and match counts, and saves them as JSON.
+
+Run it:                      python bench/replay.py --out replay.json
+Check against a baseline:    python bench/replay.py --baseline replay.json
+Without the A2A model:       python bench/replay.py --stub-a2a
+
+A baseline check fails (exit status 1) if any filter's match count changed or if throughput fell by
+more than --tolerance.
+"""
+import argparse
+import asyncio
+import csv
+import datetime
+import json
+import logging
+import os
+import platform
+import re
+import resource
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+CORPORA = ["messages.csv", "data.csv", "processed_data.csv"]
+
+# keep the bot's state out of the working tree, make no translation requests, and never drop work
+STATE_DIR = tempfile.mkdtemp(prefix="nano-replay-")
+os.environ.setdefault("NANO_SCRAPE_DIR", os.path.join(STATE_DIR, "scrape"))
+os.environ.setdefault("NANO_STORE_DIR", os.path.join(STATE_DIR, "store"))
+os.environ.setdefault("NANO_TRANSLATION_BACKEND", "stub")
+os.environ.setdefault("NANO_NLP_POLICY", "wait")
+# the weather cog reads its key when it is imported; no request is ever made with it
+os.environ.setdefault("OWM_KEY", "replay")
+# models and resources are found relative to the repository root, so paths given on the command line
+# are resolved against where it was run from
+CWD = Path.cwd()
+os.chdir(ROOT)
+sys.path.insert(0, str(ROOT / "src"))
+import bot
+import filters
+from constants import LANGUAGE_DETECTOR, NLP_WORKERS
+from cache import TTLCache
+from metrics import metrics
+from outbound import scheduler
+from workers import pool
+
+MENTION_RE = re.compile(r"@(\w+)")
+
+
+class FakeGuild:
+    def __init__(self, name):
+        self.id = hash(name)
+        self.name = name
+
+    def get_member(self, user_id):
+        return None
+
+
+class FakeChannel:
+    def __init__(self, name, guild):
+        self.id = hash((guild.name, name))
+        self.name = name
+        self.guild = guild
+
+    async def fetch_message(self, message_id):
+        raise LookupError("replayed messages are never replies")
+
+
+class FakeUser:
+    def __init__(self, name, created_at=None, joined_at=None):
+        self.id = hash(name)
+        self.name = name
+        self.display_name = name
+        self.created_at = created_at
+        self.joined_at = joined_at
+
+
+class FakeMessage:
+    """Just enough of discord.Message for the filters. Reactions and replies are recorded in
+    actions instead of being sent."""
+
+    def __init__(self, row, channel, actions):
+        self.id = row["id"]
+        self.content = row["content"]
+        self.channel = channel
+        self.guild = channel.guild
+        self.author = FakeUser(row["author"], row["author_created"], row["author_joined"])
+        self.created_at = row["created"]
+        # scraped content has mentions rendered as @name
+        self.mentions = [FakeUser(name) for name in MENTION_RE.findall(row["content"])]
+        self.reference = None
+        self.actions = actions
+
+    def is_system(self):
+        return False
+
+    async def add_reaction(self, emoji):
+        self.actions.append("react")
+
+    async def reply(self, content, **kwargs):
+        self.actions.append("reply")
+
+
+def parse_time(value):
+    return datetime.datetime.fromisoformat(value) if value else None
+
+
+def load(paths, actions):
+    """The distinct messages in the CSV dumps, oldest first. The dumps overlap (processed_data.csv
+    has the messages in data.csv again, with ids mangled into floats), so a message is kept from
+    the first dump it is in, identified by when it was posted, its author and its content."""
+    rows = {}
+    for path in paths:
+        with open(path, newline="", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                key = (row["created"], row["author"], row["content"])
+                if key in rows:
+                    continue
+                rows[key] = {
+                    "id": row["id"],
+                    "content": row["content"] or "",
+                    "server": row["server"],
+                    "channel": row["channel"],
+                    "created": parse_time(row["created"]),
+                    "author": row["author"],
+                    "author_created": parse_time(row["author_created"]),
+                    "author_joined": parse_time(row["author_joined"]),
+                }
+    rows = sorted(rows.values(), key=lambda row: row["created"])
+    guilds = {}
+    channels = {}
+    messages = []
+    for row in rows:
+        guild = guilds.setdefault(row["server"], FakeGuild(row["server"]))
+        key = (row["server"], row["channel"])
+        channel = channels.setdefault(key, FakeChannel(row["channel"], guild))
+        messages.append(FakeMessage(row, channel, actions))
+    return messages
+
+
+async def replay(cog, messages, concurrency):
+    for i in range(0, len(messages), concurrency):
+        await asyncio.gather(*(cog.on_message(msg) for msg in messages[i : i + concurrency]))
+
+
+def histogram_stats(h):
+    return {
+        "count": h.count,
+        "mean_ms": h.sum / h.count * 1000 if h.count else 0.0,
+        "p50_ms": h.quantile(0.5) * 1000,
+        "p90_ms": h.quantile(0.9) * 1000,
+        "p99_ms": h.quantile(0.99) * 1000,
+    }
+
+
+def filter_stats():
+    stats = {}
+    for (name, labels), h in metrics.histograms.items():
+        if name == "filter_seconds":
+            label = dict(labels)["filter"]
+            stats[label] = {
+                **histogram_stats(h),
+                "matches": metrics.counter("filter_matches_total", filter=label).value,
+            }
+    return dict(sorted(stats.items()))
+
+
+async def run(args):
+    actions = []
+    messages = load(args.paths, actions)
+    cog = bot.OwnerCommands(None)
+    # responses are only recorded, so there are no rate limits to keep to
+    scheduler.limited = False
+    top_level = [f.name for f in cog.filters]
+
+    if args.stub_a2a:
+
+        async def infer(text):
+            return {"GOOD": 1.0, "BAD": 0.0}
+
+        filters.a2a_classifier.infer = infer
+
+    # load models and tables, fill the caches of one pass, then measure
+    await replay(cog, messages[: args.warmup], args.concurrency)
+    await scheduler.drain()
+    if args.tracemalloc:
+        tracemalloc.start()
+    runs = []
+    for _ in range(args.repeat):
+        metrics.reset()
+        actions.clear()
+        # every pass replays the same messages, which must not be counted along with the last pass's
+        for f in cog.filters:
+            f.reset()
+        # ...and starts with a cold cache, so its hit rate is the corpus's own
+        filters.a2a_classifier.cache = TTLCache(maxsize=filters.a2a_classifier.cache.maxsize)
+        start = time.perf_counter()
+        await replay(cog, messages, args.concurrency)
+        await scheduler.drain()
+        elapsed = time.perf_counter() - start
+        stats = filter_stats()
+        runs.append(
+            {
+                "seconds": elapsed,
+                "msgs_per_sec": len(messages) / elapsed,
+                "matches": {name: stats.get(name, {}).get("matches", 0) for name in top_level},
+                "actions": {kind: actions.count(kind) for kind in ("react", "reply")},
+            }
+        )
+    tracemalloc_peak = tracemalloc.get_traced_memory()[1] if args.tracemalloc else None
+    if args.tracemalloc:
+        tracemalloc.stop()
+    if pool.executor is not None:
+        pool.executor.shutdown()
+
+    rates = [r["msgs_per_sec"] for r in runs]
+    return {
+        "config": {
+            "paths": [str(path) for path in args.paths],
+            "repeat": args.repeat,
+            "warmup": args.warmup,
+            "concurrency": args.concurrency,
+            "stub_a2a": args.stub_a2a,
+            "nlp_workers": NLP_WORKERS,
+            "language_detector": LANGUAGE_DETECTOR,
+            "python": platform.python_version(),
+        },
+        "messages": len(messages),
+        "msgs_per_sec": {"median": statistics.median(rates), "best": max(rates), "runs": rates},
+        "message_latency": histogram_stats(metrics.histogram("message_seconds")),
+        "filters": filter_stats(),
+        "a2a_cascade": {
+            dict(labels)["decision"]: c.value
+            for (name, labels), c in metrics.counters.items()
+            if name == "a2a_cascade_total"
+        },
+        "a2a_cache": {
+            result: metrics.counter("a2a_cache_total", result=result).value
+            for result in ("hit", "miss")
+        },
+        "matches": runs[-1]["matches"],
+        "actions": runs[-1]["actions"],
+        "deterministic": all(r["matches"] == runs[0]["matches"] for r in runs),
+        # ru_maxrss is in kilobytes on Linux
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "tracemalloc_peak_mb": tracemalloc_peak / 2 ** 20 if tracemalloc_peak else None,
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Returns the ways results regressed from baseline."""
+    problems = []
+    for name in sorted(set(results["matches"]) | set(baseline["matches"])):
+        old = baseline["matches"].get(name)
+        new = results["matches"].get(name)
+        if old != new:
+            problems.append(f"{name} matched {new} messages, was {old}")
+    old = baseline["msgs_per_sec"]["median"]
+    new = results["msgs_per_sec"]["median"]
+    if new < old * (1 - tolerance):
+        problems.append(f"throughput fell from {old:.0f} to {new:.0f} messages/s")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("paths", nargs="*", type=Path, default=[ROOT / path for path in CORPORA])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--warmup", type=int, default=200, help="messages replayed first, untimed")
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--stub-a2a", action="store_true", help="skip the A2A model")
+    parser.add_argument("--tracemalloc", action="store_true", help="also trace Python allocations")
+    parser.add_argument("--out", help="save the results as JSON here")
+    parser.add_argument("--baseline", help="JSON results to check these against")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+    args.paths = [CWD / path for path in args.paths]
+    logging.getLogger().setLevel(logging.WARNING)
+
+    results = asyncio.run(run(args))
+    rate = results["msgs_per_sec"]
+    print(f"{results['messages']} messages, {rate['median']:.0f} msgs/s (best {rate['best']:.0f})")
+    latency = results["message_latency"]
+    print(f"per message: mean {latency['mean_ms']:.3f} ms, p99 {latency['p99_ms']:.3f} ms")
+    for name, stats in results["filters"].items():
+        print(
+            f"  {name}: {stats['count']} evaluated, {stats['matches']} matched, "
+            f"mean {stats['mean_ms']:.3f} ms, p50 {stats['p50_ms']:.3f} ms, "
+            f"p99 {stats['p99_ms']:.3f} ms"
+        )
+    print(f"A2A cascade decisions: {results['a2a_cascade']}")
+    cache = results["a2a_cache"]
+    total = cache["hit"] + cache["miss"]
+    rate = cache["hit"] / total if total else 0.0
+    print(f"A2A cache: {cache['hit']} hits, {cache['miss']} misses, hit rate {rate:.1%}")
+    print(f"actions: {results['actions']}, peak RSS {results['peak_rss_mb']:.0f} MB")
+    if args.out:
+        with open(CWD / args.out, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(CWD / args.baseline) as f:
+            problems = compare(results, json.load(f), args.tolerance)
+        for problem in problems:
+            print(f"REGRESSION: {problem}")
+        if problems:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
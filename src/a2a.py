@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+
+"""Batched, memoized inference for the ask-to-ask text classifier."""
+import asyncio
+import hashlib
+import re
+from a2a_student import STUDENT_DIR, model_fingerprint
+from cache import TTLCache
+from constants import A2A_BACKEND, A2A_CACHE_PATH, A2A_MODEL
+from metrics import metrics
+from workers import classify_batch
+
+REPEATED_PUNCTUATION_RE = re.compile(r"([^\w\s])\1+")
+
+
+def normalize(text):
+    """text lowercased, with runs of whitespace and of the same punctuation mark collapsed, so that
+    "can anyone help??" and "Can anyone  help?" are classified once."""
+    return " ".join(REPEATED_PUNCTUATION_RE.sub(r"\1", text.lower()).split())
+
+
+class BatchClassifier:
+    """Runs the ask-to-ask classifier over small batches of texts in a WorkerPool. Callers await
+    classify for a single text; texts arriving within window seconds of each other, up to max_batch
+    of them, are run through nlp.pipe together and each caller gets its own cats back.
+
+    Results are memoized in cache by a hash of the normalized text, and identical texts already on
+    their way to the pool share its result. Keys include a fingerprint of the model's meta.json, so
+    a retrained model never gets the old one's results, even from the cache on disk."""
+
+    def __init__(self, pool, max_batch=32, window=0.005, batch_size=32, cache=None, model=None):
+        self.pool = pool
+        self.max_batch = max_batch
+        self.window = window
+        self.batch_size = batch_size
+        if cache is None:
+            # entries never expire; the fingerprint in their keys is what retires them
+            cache = TTLCache(maxsize=4096, path=A2A_CACHE_PATH, table="a2a_cats")
+        self.cache = cache
+        if model is None:
+            model = STUDENT_DIR if A2A_BACKEND == "student" else A2A_MODEL
+        self.model = model
+        self.fingerprint = None
+        self.pending = []
+        # cache key -> future of the cats for texts waiting for a batch or in one
+        self.in_flight = {}
+        self.flush_handle = None
+
+    def key(self, text):
+        if self.fingerprint is None:
+            fp = model_fingerprint(self.model)
+            self.fingerprint = f"{fp['version']}-{fp['meta_sha1'][:12]}"
+        digest = hashlib.sha1(normalize(text).encode("utf-8")).hexdigest()
+        return f"{self.fingerprint}:{digest}"
+
+    async def classify(self, text):
+        """Returns the category scores for text, or None if the pool was too busy to run it."""
+        key = self.key(text)
+        cats = self.cache.get(key)
+        if cats is not None:
+            metrics.inc("a2a_cache_total", result="hit")
+            return cats
+        metrics.inc("a2a_cache_total", result="miss")
+        future = self.in_flight.get(key)
+        if future is None:
+            future = self.in_flight[key] = asyncio.ensure_future(self.infer(text))
+            future.add_done_callback(lambda f: self.done(key, f))
+        return await asyncio.shield(future)
+
+    def done(self, key, future):
+        del self.in_flight[key]
+        if not future.cancelled() and future.exception() is None and future.result() is not None:
+            self.cache.set(key, future.result())
+
+    async def infer(self, text):
+        """Runs text through the model in the next batch."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.append((text, future))
+        if len(self.pending) >= self.max_batch:
+            self.flush()
+        elif self.flush_handle is None:
+            self.flush_handle = loop.call_later(self.window, self.flush)
+        return await future
+
+    def flush(self):
+        """Sends everything waiting to the worker as one batch."""
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        batch, self.pending = self.pending, []
+        if batch:
+            asyncio.ensure_future(self.run(batch))
+
+    async def run(self, batch):
+        texts = [text for text, _ in batch]
+        metrics.inc("a2a_batches_total")
+        metrics.inc("a2a_texts_total", len(texts))
+        try:
+            results = await self.pool.run(classify_batch, texts, self.batch_size)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        if results is None:
+            results = [None] * len(batch)
+        for (_, future), cats in zip(batch, results):
+            if not future.done():
+                future.set_result(cats)
+
+    def stats(self):
+        return {**self.cache.stats(), "in_flight": len(self.in_flight)}
+
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+
+"""Compact NumPy-only stand-in for the ask-to-ask spaCy model: a student network distilled from it.
+
+The student averages the embeddings of a message's hashed word n-grams and affixes, passes that
+through one hidden ReLU layer, and outputs the logit of BAD against GOOD. It is fit to the teacher's
+logits on every message in the corpora, so it reproduces the teacher's decisions near A2AFilter's
+threshold rather than just the labels. The labelled messages in data.jsonl are left out, so that
+bench/a2a_student.py can check the student against the teacher on messages it never saw. Its weights are plain .npy files that are memory-mapped on
+load. That takes milliseconds, and worker processes share the pages instead of each holding a copy
+of a spaCy pipeline.
+
+Export it with python src/a2a_student.py, which needs the trained model in A2A_MODEL. Without it,
+python src/a2a_student.py --from-labels fits the student to the labels in data.jsonl instead, which
+is only good for trying it out.
+"""
+import argparse
+import csv
+import hashlib
+import json
+import os
+import numpy as np
+import features
+from constants import A2A_MODEL
+
+STUDENT_DIR = "resources/a2a_student"
+LABELLED_DATA = "textcat_demo/assets/data.jsonl"
+CORPORA = ["data.csv", "messages.csv", "hour.csv", "test.csv", "processed_data.csv"]
+
+HASH_DIM = 2 ** 14
+WIDTH = 64
+# teacher logits are clipped to this, since past it the decision never changes
+MAX_LOGIT = 12.0
+# with --from-labels, the logit labels are fit to
+LABEL_LOGIT = 6.0
+EPOCHS = 40
+BATCH = 64
+LEARNING_RATE = 3e-3
+SEED = 0
+
+WEIGHTS = ("embed", "w1", "b1", "w2", "b2")
+
+
+def grams(text):
+    """The student's features: features.affixes, plus a gram every text has, so none is empty."""
+    return ["^"] + features.affixes(text)
+
+
+def model_fingerprint(model=A2A_MODEL):
+    """A model directory's version and a hash of its meta.json, to tell which model a student (or
+    anything else derived from the model) came from. Students exported before they had versions
+    are told apart by the hash alone."""
+    with open(os.path.join(model, "meta.json"), "rb") as f:
+        raw = f.read()
+    version = json.loads(raw).get("version", "unversioned")
+    return {"version": version, "meta_sha1": hashlib.sha1(raw).hexdigest()}
+
+
+def eval_texts():
+    """The distinct labelled messages, lowercased as A2AFilter sees them, which are held out of
+    distillation."""
+    with open(LABELLED_DATA, encoding="utf-8") as f:
+        return sorted({json.loads(line)["text"].lower() for line in f})
+
+
+def corpus_texts():
+    """Every distinct message in the corpora, lowercased as A2AFilter sees them, except the held
+    out ones in eval_texts."""
+    texts = set()
+    for path in CORPORA:
+        with open(path, newline="", encoding="utf-8") as f:
+            texts.update(row["content"].lower() for row in csv.DictReader(f) if row["content"])
+    return sorted(texts - set(eval_texts()))
+
+
+def teacher_logits(texts, model=A2A_MODEL):
+    import spacy
+
+    nlp = spacy.load(model)
+    cats = [doc.cats for doc in nlp.pipe(texts, batch_size=256)]
+    return np.array(
+        [np.log(max(c["BAD"], 1e-12)) - np.log(max(c["GOOD"], 1e-12)) for c in cats]
+    )
+
+
+def labelled():
+    with open(LABELLED_DATA, encoding="utf-8") as f:
+        rows = [json.loads(line) for line in f]
+    texts = [row["text"].lower() for row in rows]
+    targets = np.array([LABEL_LOGIT if row["cats"]["BAD"] else -LABEL_LOGIT for row in rows])
+    return texts, targets
+
+
+def batch_indices(texts, dim):
+    """Flattened gram indices of texts, the offset each text's start at, and their counts."""
+    idx = [features.hashed(text, dim, grams) for text in texts]
+    lengths = np.array([len(i) for i in idx])
+    offsets = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+    return np.concatenate(idx), offsets, lengths
+
+
+def forward(weights, flat, offsets, lengths):
+    """Hidden activations and the output logit for each text."""
+    h0 = np.add.reduceat(weights["embed"][flat], offsets, axis=0) / lengths[:, None]
+    h1 = np.maximum(h0 @ weights["w1"] + weights["b1"], 0)
+    return h0, h1, h1 @ weights["w2"] + weights["b2"]
+
+
+def train(texts, targets):
+    """Student weights fit to the target logits by mean squared error, with Adam."""
+    rng = np.random.default_rng(SEED)
+    weights = {
+        "embed": rng.normal(0, 0.1, (HASH_DIM, WIDTH)).astype(np.float32),
+        "w1": rng.normal(0, 1 / np.sqrt(WIDTH), (WIDTH, WIDTH)).astype(np.float32),
+        "b1": np.zeros(WIDTH, dtype=np.float32),
+        "w2": rng.normal(0, 1 / np.sqrt(WIDTH), WIDTH).astype(np.float32),
+        "b2": np.zeros((), dtype=np.float32),
+    }
+    moments = {k: (np.zeros_like(w), np.zeros_like(w)) for k, w in weights.items()}
+    encoded = [features.hashed(text, HASH_DIM, grams) for text in texts]
+    targets = np.clip(targets, -MAX_LOGIT, MAX_LOGIT).astype(np.float32)
+    step = 0
+    for _ in range(EPOCHS):
+        order = rng.permutation(len(texts))
+        for start in range(0, len(order), BATCH):
+            batch = order[start : start + BATCH]
+            lengths = np.array([len(encoded[i]) for i in batch])
+            flat = np.concatenate([encoded[i] for i in batch])
+            offsets = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+            h0, h1, z = forward(weights, flat, offsets, lengths)
+
+            dz = 2 * (z - targets[batch]) / len(batch)
+            grads = {"w2": h1.T @ dz, "b2": dz.sum()}
+            dh1 = np.outer(dz, weights["w2"]) * (h1 > 0)
+            grads["w1"] = h0.T @ dh1
+            grads["b1"] = dh1.sum(axis=0)
+            dh0 = (dh1 @ weights["w1"].T) / lengths[:, None]
+            # only the embedding rows of the batch's grams have gradients, so only they are
+            # updated ("lazy" Adam), which is most of what keeps training fast
+            by_row = np.argsort(flat, kind="stable")
+            rows, starts = np.unique(flat[by_row], return_index=True)
+            d_embed = np.add.reduceat(np.repeat(dh0, lengths, axis=0)[by_row], starts, axis=0)
+
+            step += 1
+            for k, g in grads.items():
+                weights[k] = weights[k] - adam(moments[k], g, step, ...)
+            weights["embed"][rows] -= adam(moments["embed"], d_embed, step, rows)
+    return weights
+
+
+def adam(moments, g, step, rows):
+    """Adam's update for the given rows of a weight with gradient g, updating its moments."""
+    m, v = moments
+    m[rows] = 0.9 * m[rows] + 0.1 * g
+    v[rows] = 0.999 * v[rows] + 0.001 * g * g
+    m_hat = m[rows] / (1 - 0.9 ** step)
+    v_hat = v[rows] / (1 - 0.999 ** step)
+    return (LEARNING_RATE * m_hat / (np.sqrt(v_hat) + 1e-8)).astype(np.float32)
+
+
+def export(path=STUDENT_DIR, from_labels=False, model=A2A_MODEL):
+    """Distills the teacher in model into a student, or fits it to the labels, and writes it to
+    path."""
+    if from_labels:
+        texts, targets = labelled()
+        teacher = None
+    else:
+        texts = corpus_texts()
+        targets = teacher_logits(texts, model)
+        teacher = model_fingerprint(model)
+    weights = train(texts, targets)
+    os.makedirs(path, exist_ok=True)
+    digest = hashlib.sha1()
+    for name in WEIGHTS:
+        np.save(os.path.join(path, f"{name}.npy"), weights[name])
+        digest.update(weights[name].tobytes())
+    # the teacher's version (like a spaCy model's), marked with which weights were fit to it
+    version = f"{teacher['version'] if teacher else 'labels'}+student.{digest.hexdigest()[:12]}"
+    with open(os.path.join(path, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(
+            {
+                "version": version,
+                "hash_dim": HASH_DIM,
+                "width": WIDTH,
+                "labels": ["GOOD", "BAD"],
+                "source": "labels" if from_labels else "teacher",
+                "teacher": teacher,
+                "examples": len(texts),
+            },
+            f,
+            indent=2,
+        )
+
+
+class StudentClassifier:
+    """Memory-mapped student written by export, scoring texts in batches."""
+
+    def __init__(self, path=STUDENT_DIR):
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self.hash_dim = self.meta["hash_dim"]
+        self.weights = {
+            name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r") for name in WEIGHTS
+        }
+
+    def logits(self, texts):
+        """Logit of BAD against GOOD for each text."""
+        if not texts:
+            return np.zeros(0, dtype=np.float32)
+        flat, offsets, lengths = batch_indices(texts, self.hash_dim)
+        return forward(self.weights, flat, offsets, lengths)[2]
+
+    def cats(self, texts):
+        """Category scores for each text, like doc.cats from the spaCy model."""
+        bad = 1 / (1 + np.exp(-self.logits(texts).astype(np.float64)))
+        return [{"GOOD": float(1 - p), "BAD": float(p)} for p in bad]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--from-labels",
+        action="store_true",
+        help="fit to the labels in data.jsonl instead of distilling the model",
+    )
+    args = parser.parse_args()
+    export(from_labels=args.from_labels)
+    student = StudentClassifier()
+    print(f"Exported the ask-to-ask student to {STUDENT_DIR}: {student.meta}")
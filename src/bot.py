@@ -4,17 +4,23 @@ import discord
 from discord.ext import commands
 import os
 import logging
-import pandas as pd
+import csv
 import typing
-import datetime
-import requests
 import random
 import asyncio
 import html
 import sys
 import configparser
-from constants import NAME
+import io
+from constants import NAME, A2A_CASCADE, SCRAPE_DIR, STORE_DIR, METRICS_PORT
 from filters import *
+from workers import pool
+from registry import registry
+from metrics import metrics, serve_prometheus
+from profiler import SamplingProfiler
+from outbound import scheduler
+from scrape import Scraper, ScrapeState
+from translation import TranslationError, translator
 from cogs.trivia import TriviaCommands
 from cogs.mw_cog import MWCommands
 from cogs.wiki import WikiCommands
@@ -26,6 +32,16 @@ from cogs.images import ImageCommands
 
 logging.basicConfig(level=logging.INFO)
 
+
+def load_message_store():
+    # the store needs pyarrow, which takes pandas with it, so it is only imported when scraping
+    from store import MessageStore
+
+    return MessageStore(STORE_DIR)
+
+
+registry.register("message_store", load_message_store)
+
 intents = discord.Intents.default()
 intents.members = True
 
@@ -79,13 +95,40 @@ class OwnerCommands(commands.Cog):
             ComboFilter(
                 (WatchedChannelFilter(self.standard_channels), ForeignLangFilter())
             ),
+            ComboFilter((WatchedChannelFilter(self.standard_channels), RepostFilter())),
+            ComboFilter((WatchedChannelFilter(self.standard_channels), ChannelOveruseFilter())),
+            ComboFilter((WatchedChannelFilter(self.standard_channels), PingAbuseFilter())),
         )
+        self.dispatch = FilterIndex(self.filters)
+        self.scraper = None
+        self.metrics_server = None
+
+    async def get_scraper(self):
+        """The scraper, made along with the message store the first time it is needed."""
+        if self.scraper is None:
+            store = await asyncio.get_running_loop().run_in_executor(
+                None, registry.get, "message_store"
+            )
+            if self.scraper is None:
+                os.makedirs(SCRAPE_DIR, exist_ok=True)
+                self.scraper = Scraper(
+                    store, ScrapeState(os.path.join(SCRAPE_DIR, "state.sqlite"))
+                )
+        return self.scraper
 
     @commands.Cog.listener()
     async def on_ready(self):
         logging.info("Nano Is Ready!")
         game = discord.Game("with Sakamoto")
         await self.client.change_presence(status=discord.Status.idle, activity=game)
+        if METRICS_PORT and self.metrics_server is None:
+            self.metrics_server = await serve_prometheus(int(METRICS_PORT))
+            logging.info("Serving metrics on port %s", METRICS_PORT)
+        # the workers load their own models; everything else the bot process needs is warmed here
+        await registry.warm(
+            ["unicode_index", "resources", "translator", "langid"]
+            + (["a2a_cascade"] if A2A_CASCADE else [])
+        )
 
     @commands.Cog.listener()
     async def on_message(self, msg):
@@ -96,12 +139,15 @@ class OwnerCommands(commands.Cog):
         ):
             return
 
-        for f in self.filters:
-            if await f.matches(msg):
-                logging.debug(f"{msg.content} matched {f}...")
-                await f.respond(msg)
-            else:
-                logging.debug(f"{msg.content} did not match {f}...")
+        with metrics.timer("message_seconds"):
+            context = MessageContext(msg)
+            for f in self.dispatch.candidates(msg, context):
+                if await evaluate(f, msg, context):
+                    logging.debug("%s matched %s", msg.content, f.name)
+                    with metrics.timer("respond_seconds", filter=f.name):
+                        await f.respond(msg, context)
+                else:
+                    logging.debug("%s did not match %s", msg.content, f.name)
 
     @commands.command()
     @commands.is_owner()
@@ -111,51 +157,69 @@ class OwnerCommands(commands.Cog):
             await ctx.send(guild.name)
             logging.info(guild.name)
 
+    @commands.command()
+    @commands.is_owner()
+    async def stats(self, ctx):
+        """Show latency percentiles, counters and queue depths."""
+        lines = metrics.summary()
+        lines += [f"nlp pool {key}: {value}" for key, value in pool.stats().items()]
+        lines += [f"outbound {key}: {value}" for key, value in scheduler.stats().items()]
+        lines += [f"translations {key}: {value}" for key, value in translator.stats().items()]
+        lines += [f"reposts {key}: {value}" for key, value in repost_index.stats().items()]
+        lines += [f"a2a cache {key}: {value}" for key, value in a2a_classifier.stats().items()]
+        # Discord messages are limited to 2000 characters
+        text = ""
+        for line in lines:
+            if len(text) + len(line) > 1900:
+                await ctx.send(f"```\n{text}```")
+                text = ""
+            text += line + "\n"
+        if text:
+            await ctx.send(f"```\n{text}```")
+
+    @commands.command()
+    @commands.is_owner()
+    async def profile(self, ctx, seconds: typing.Optional[float] = 10):
+        """Sample the bot's stack for some seconds (at most 60) and upload the collapsed stacks, for
+        flamegraph.pl or speedscope."""
+        seconds = min(max(seconds, 1), 60)
+        await ctx.send(f"Profiling for {seconds:g} seconds...")
+        profiler = SamplingProfiler()
+        stacks = await profiler.profile(seconds)
+        await ctx.send(
+            f"{profiler.samples} samples",
+            file=discord.File(io.BytesIO(stacks.encode("utf-8")), "nano.folded"),
+        )
+
+    def is_watched_channel(self, channel):
+        return any(channel.name.startswith(pref) for pref in self.standard_channels)
+
     @commands.command()
     @commands.is_owner()
     async def scrape(self, ctx, limit: typing.Optional[int] = 200):
-        self.msgs = []
         async with ctx.typing():
-            num_msgs = 0
             guild = ctx.guild
             logging.info(f"Scraping {guild.name}...")
-            for channel in guild.text_channels:
-                logging.info(f"Channel {channel.name}")
-                if self.is_watched_channel(channel):
-                    logging.info("Matched, scraping messages...")
-                    async for msg in channel.history(limit=limit):
-                        if not msg.is_system():
-                            author = msg.author
-                            joined = user_joined(guild.get_member(author.id))
-                            if joined is None or (
-                                msg.created_at - joined
-                            ) <= datetime.timedelta(hours=1):
-                                row = {
-                                    "id": msg.id,
-                                    "content": msg.clean_content,
-                                    "server": msg.guild.name,
-                                    "channel": msg.channel.name,
-                                    "created": msg.created_at,
-                                    "author": author.name,
-                                    "author_created": author.created_at,
-                                    "author_joined": joined,
-                                }
-                                if row["id"] not in self.msg_ids:
-                                    self.msg_ids.append(row["id"])
-                                    self.msgs.append(row)
-                                    num_msgs += 1
-                    else:
-                        logging.info("Not a match, moving on")
+            channels = [c for c in guild.text_channels if self.is_watched_channel(c)]
+            scraper = await self.get_scraper()
+            num_msgs = await scraper.scrape(channels, limit)
             logging.info("Done!")
         await ctx.send(f"Done! Scraped {num_msgs} messages")
 
     @commands.command()
     @commands.is_owner()
-    async def write(self, ctx, filename: typing.Optional[str] = "messages"):
+    async def write(self, ctx, filename: typing.Optional[str] = None):
+        """Compacts the message store, and also dumps it to filename.csv if given."""
         async with ctx.typing():
-            msg_df = pd.DataFrame(self.msgs)
-            msg_df.to_csv(filename + ".csv", index=False)
-        await ctx.send(f"Done! Logged {len(self.msgs)} messages!")
+            store = (await self.get_scraper()).sink
+            await asyncio.get_running_loop().run_in_executor(None, store.compact)
+            if filename is not None:
+                with open(filename + ".csv", "w", newline="", encoding="utf-8") as f:
+                    writer = csv.DictWriter(f, fieldnames=SCRAPE_FIELDS)
+                    writer.writeheader()
+                    for row in store.read():
+                        writer.writerow(row)
+        await ctx.send(f"Done! Stored {len(store)} messages!")
 
     @commands.command("activate!")
     async def get_em(self, ctx):
@@ -168,8 +232,9 @@ class OwnerCommands(commands.Cog):
             # don't double-trigger
             # TODO maybe refactor the filters list to be a named tuple so you can just reference
             # that filter instead of remaking it here
-            if not await AnyoneAgree(self.bmu_list).matches(ctx.message):
-                await AnyoneAgree([], check_names=False).respond(ctx.message)
+            context = MessageContext(ctx.message)
+            if not await AnyoneAgree(self.bmu_list).matches(ctx.message, context):
+                await AnyoneAgree([], check_names=False).respond(ctx.message, context)
 
 
 class TranslationCommands(commands.Cog):
@@ -177,8 +242,8 @@ class TranslationCommands(commands.Cog):
     async def translate(self, ctx, *args):
         """Translate the given text into English, guessing its source language."""
         try:
-            await ForeignLangFilter().respond(ctx.message)
-        except LangDetectException:
+            await ForeignLangFilter().respond(ctx.message, MessageContext(ctx.message))
+        except TranslationError:
             await ctx.send("Could not infer source language. Darn! >_<")
 
     @commands.command()
@@ -187,7 +252,22 @@ class TranslationCommands(commands.Cog):
         await self.translate(ctx, *args)
 
 
+SCRAPE_FIELDS = (
+    "id",
+    "content",
+    "server",
+    "channel",
+    "created",
+    "author",
+    "author_created",
+    "author_joined",
+    "label",
+)
+
+
 def setup(client):
+    # starting the pool only forks the workers; they load their models in parallel with connecting
+    pool.start()
     client.add_cog(OwnerCommands(client))
     client.add_cog(TriviaCommands(client))
     client.add_cog(WikiCommands(client))
@@ -199,9 +279,10 @@ def setup(client):
     client.add_cog(ImageCommands(client))
 
 
-bot = commands.Bot(f"{NAME}, ", intents=intents)
-setup(bot)
-bot.run(os.environ['NANO_TOKEN'])
+if __name__ == "__main__":
+    bot = commands.Bot(f"{NAME}, ", intents=intents)
+    setup(bot)
+    bot.run(os.environ['NANO_TOKEN'])
 
 
 # @client.event
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+
+"""Bounded in-memory cache with expiring entries and an optional SQLite tier on disk."""
+from collections import OrderedDict
+import asyncio
+import atexit
+import json
+import sqlite3
+import time
+
+# by default, writes to disk are committed together once there are this many of them, or this long
+# after the first of them, whichever comes first
+COMMIT_EVERY = 64
+COMMIT_SECONDS = 1.0
+# the disk tier is trimmed back to disk_maxsize only once it is this fraction over it
+TRIM_SLACK = 1 / 8
+
+# path -> the connection every cache stored there shares, since one holding its uncommitted writes
+# would lock the others out
+connections = {}
+
+
+def connect(path):
+    if path not in connections:
+        connections[path] = sqlite3.connect(path)
+    return connections[path]
+
+
+class TTLCache:
+    """Mapping from string keys to values holding at most maxsize entries, each of which expires ttl
+    seconds after it was set (never, if ttl is None). When full, the least recently used entry is
+    evicted. If path is given, entries are also written through to a SQLite database there, so that
+    they survive restarts; values must then be JSON-serializable. The disk tier holds up to
+    disk_maxsize entries and evicts the least recently used of them too. Its writes are committed
+    commit_every at a time, or COMMIT_SECONDS after the first uncommitted one by a timer on the
+    running event loop, so a crash can lose the last second or so of them. Caches used outside an
+    event loop, and ones made with commit_every=1, commit every write."""
+
+    def __init__(
+        self,
+        maxsize=1024,
+        ttl=None,
+        path=None,
+        table="cache",
+        disk_maxsize=None,
+        commit_every=COMMIT_EVERY,
+    ):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.table = table
+        self.disk_maxsize = disk_maxsize if disk_maxsize is not None else 16 * maxsize
+        self.db = None
+        # key -> when it was last used, for entries whose row's touched is behind
+        self.touches = {}
+        self.commit_every = commit_every
+        self.uncommitted = 0
+        self.commit_handle = None
+        if path is not None:
+            self.db = connect(path)
+            self.db.execute(
+                f"CREATE TABLE IF NOT EXISTS {table} "
+                "(key TEXT PRIMARY KEY, value TEXT, expires REAL, touched REAL)"
+            )
+            self.db.execute(f"CREATE INDEX IF NOT EXISTS {table}_touched ON {table} (touched)")
+            self.db.execute(f"DELETE FROM {table} WHERE expires < ?", (time.time(),))
+            self.db.commit()
+            # counts every set as a new row, so it can only overestimate until the next trim
+            self.disk_size = self.db.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+            atexit.register(self.flush)
+
+    def __len__(self):
+        return len(self.data)
+
+    def __contains__(self, key):
+        return self.get(key, count=False) is not None
+
+    def expiry(self, ttl):
+        ttl = self.ttl if ttl is None else ttl
+        return float("inf") if ttl is None else time.time() + ttl
+
+    def get(self, key, default=None, count=True):
+        """Returns the value for key, or default if it is missing or expired."""
+        now = time.time()
+        if key in self.data:
+            expires, value = self.data[key]
+            if expires >= now:
+                self.data.move_to_end(key)
+                self.touch(key, now)
+                self.hits += count
+                return value
+            del self.data[key]
+        if self.db is not None:
+            row = self.db.execute(
+                f"SELECT value, expires FROM {self.table} WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and row[1] >= now:
+                value = json.loads(row[0])
+                self.put(key, value, row[1])
+                self.touch(key, now)
+                self.hits += count
+                return value
+        self.misses += count
+        return default
+
+    def set(self, key, value, ttl=None):
+        """Stores value under key, expiring ttl seconds from now (defaulting to the cache's ttl)."""
+        expires = self.expiry(ttl)
+        self.put(key, value, expires)
+        if self.db is not None:
+            self.touches.pop(key, None)
+            self.db.execute(
+                f"INSERT OR REPLACE INTO {self.table} VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), expires, time.time()),
+            )
+            self.disk_size += 1
+            if self.disk_size > self.disk_maxsize * (1 + TRIM_SLACK):
+                self.trim()
+            self.written()
+
+    def put(self, key, value, expires):
+        self.data[key] = (expires, value)
+        self.data.move_to_end(key)
+        while len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+            self.evictions += 1
+
+    def delete(self, key):
+        self.data.pop(key, None)
+        if self.db is not None:
+            self.touches.pop(key, None)
+            self.db.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+            self.written()
+
+    def touch(self, key, now):
+        """Marks key's row as used at now, to be written with the next commit."""
+        if self.db is not None:
+            self.touches[key] = now
+
+    def trim(self):
+        """Evicts the least recently used rows beyond disk_maxsize from the disk tier."""
+        self.flush_touches()
+        self.db.execute(
+            f"DELETE FROM {self.table} WHERE touched < (SELECT touched FROM {self.table} "
+            "ORDER BY touched DESC LIMIT 1 OFFSET ?)",
+            (self.disk_maxsize - 1,),
+        )
+        self.disk_size = self.db.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+
+    def written(self):
+        self.uncommitted += 1
+        if self.uncommitted >= self.commit_every:
+            self.flush()
+        elif self.commit_handle is None:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                self.flush()
+            else:
+                self.commit_handle = loop.call_later(COMMIT_SECONDS, self.flush)
+
+    def flush_touches(self):
+        if self.touches:
+            self.db.executemany(
+                f"UPDATE {self.table} SET touched = ? WHERE key = ?",
+                [(touched, key) for key, touched in self.touches.items()],
+            )
+            self.touches.clear()
+
+    def flush(self):
+        """Commits everything written to the disk tier so far."""
+        if self.db is None:
+            return
+        if self.commit_handle is not None:
+            self.commit_handle.cancel()
+            self.commit_handle = None
+        self.flush_touches()
+        self.db.commit()
+        self.uncommitted = 0
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "size": len(self.data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "evictions": self.evictions,
+        }
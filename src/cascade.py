@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+
+"""First stage of the ask-to-ask cascade: a linear scorer over hashed word n-grams and message
+metadata, cheap enough to run on every message. Messages it is confident about are decided without
+the spaCy model; the rest are escalated to it.
+
+The scorer is a logistic regression trained on the labelled messages in processed_data.csv (the
+same ones as textcat_demo/assets/data.jsonl, with their metadata). Its thresholds are calibrated on
+out-of-fold scores, so that no ask-to-ask message in the data would have been rejected without
+going to the model.
+
+Build it ahead of time with python src/cascade.py; it is also built on first load if missing.
+"""
+import csv
+import datetime
+import json
+import os
+import numpy as np
+import features
+
+CASCADE_DIR = "resources/a2a_cascade"
+TRAINING_DATA = "processed_data.csv"
+# the notebook's subset: messages posted within this many minutes of joining
+MAX_POSTED_RELATIVE = 5
+
+FOLDS = 5
+# L2 penalty and plain gradient descent schedule for fitting
+L2 = 1e-3
+STEPS = 500
+LEARNING_RATE = 0.5
+# margin, in logits, kept below the lowest-scoring ask-to-ask message when choosing the threshold
+# for rejecting without the model
+REJECT_MARGIN = 1.0
+# fewest messages above the accept threshold, all of them ask-to-ask, for accepting without the model
+MIN_ACCEPT_SUPPORT = 5
+
+
+def parse_time(value):
+    return datetime.datetime.fromisoformat(value)
+
+
+def training_data(path=TRAINING_DATA):
+    """(text, posted_relative, num_prev, is_a2a) for each labelled message, derived the way the
+    analysis notebook does."""
+    with open(path, newline="", encoding="utf-8") as f:
+        # without a join time there is no posted_relative, and the notebook drops the message
+        rows = [row for row in csv.DictReader(f) if row["author_joined"]]
+    for row in rows:
+        row["created"] = parse_time(row["created"])
+        row["posted_relative"] = (
+            row["created"] - parse_time(row["author_joined"])
+        ).total_seconds() / 60
+    rows = [row for row in rows if row["posted_relative"] > 0]
+    by_author = {}
+    for row in rows:
+        by_author.setdefault(row["author"], []).append(row["created"])
+    examples = []
+    for row in rows:
+        if row["posted_relative"] >= MAX_POSTED_RELATIVE or not row["content"]:
+            continue
+        num_prev = sum(t < row["created"] for t in by_author[row["author"]])
+        examples.append(
+            (row["content"], row["posted_relative"], num_prev, row["ask-to-ask"] == "1")
+        )
+    return examples
+
+
+def design(examples, dim=features.HASH_DIM):
+    """Dense design matrix: hashed n-gram indicators, then metadata, then a constant."""
+    x = np.zeros((len(examples), dim + len(features.METADATA) + 1), dtype=np.float64)
+    for i, (text, posted_relative, num_prev, _) in enumerate(examples):
+        x[i, features.hashed(text, dim)] = 1
+        x[i, dim:-1] = features.metadata(len(text), posted_relative, num_prev)
+        x[i, -1] = 1
+    return x
+
+
+def fit(x, y):
+    """Logistic regression weights, with the classes weighted equally since ask-to-ask messages are
+    rare."""
+    sample_weight = np.where(y, 0.5 / max(y.sum(), 1), 0.5 / max((~y).sum(), 1))
+    w = np.zeros(x.shape[1])
+    for _ in range(STEPS):
+        p = 1 / (1 + np.exp(-(x @ w)))
+        grad = x.T @ (sample_weight * (p - y)) + L2 * w
+        grad[-1] -= L2 * w[-1]
+        w -= LEARNING_RATE * grad
+    return w
+
+
+def out_of_fold_scores(x, y):
+    """Each example's score from a model fit without its fold, with the classes spread evenly
+    across folds."""
+    folds = np.empty(len(y), dtype=np.int64)
+    for label in (True, False):
+        (idx,) = np.nonzero(y == label)
+        folds[idx] = np.arange(len(idx)) % FOLDS
+    scores = np.empty(len(y))
+    for k in range(FOLDS):
+        held_out = folds == k
+        scores[held_out] = x[held_out] @ fit(x[~held_out], y[~held_out])
+    return scores
+
+
+def calibrate(scores, y):
+    """Thresholds (reject_below, accept_at_least) on the logit; accept_at_least is None if no
+    threshold has enough support."""
+    reject_below = scores[y].min() - REJECT_MARGIN
+    accept_at_least = None
+    for t in np.sort(scores)[::-1]:
+        above = scores >= t
+        if not y[above].all():
+            break
+        if above.sum() >= MIN_ACCEPT_SUPPORT:
+            accept_at_least = float(t)
+    return float(reject_below), accept_at_least
+
+
+def report(scores, y, reject_below, accept_at_least):
+    """How the first stage splits the data and how often its own decisions are wrong."""
+    rejected = scores < reject_below
+    accepted = scores >= accept_at_least if accept_at_least is not None else np.zeros_like(y)
+    decided = rejected | accepted
+    return {
+        "examples": int(len(y)),
+        "ask_to_ask": int(y.sum()),
+        "rejected": float(rejected.mean()),
+        "accepted": float(accepted.mean()),
+        "escalated": float(1 - decided.mean()),
+        "false_rejects": int((rejected & y).sum()),
+        "false_accepts": int((accepted & ~y).sum()),
+    }
+
+
+def build(path=CASCADE_DIR, data=TRAINING_DATA):
+    """Fits the scorer to data, calibrates its thresholds, and writes both to path."""
+    examples = training_data(data)
+    x = design(examples)
+    y = np.array([a2a for *_, a2a in examples])
+    scores = out_of_fold_scores(x, y)
+    reject_below, accept_at_least = calibrate(scores, y)
+    w = fit(x, y)
+
+    os.makedirs(path, exist_ok=True)
+    np.save(os.path.join(path, "weights.npy"), w.astype(np.float32))
+    with open(os.path.join(path, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(
+            {
+                "hash_dim": features.HASH_DIM,
+                "metadata": features.METADATA,
+                "reject_below": reject_below,
+                "accept_at_least": accept_at_least,
+                "cross_validation": report(scores, y, reject_below, accept_at_least),
+            },
+            f,
+            indent=2,
+        )
+
+
+class CascadeScorer:
+    """Weights and thresholds written by build."""
+
+    def __init__(self, path=CASCADE_DIR):
+        if not os.path.exists(os.path.join(path, "meta.json")):
+            build(path)
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self.hash_dim = self.meta["hash_dim"]
+        self.reject_below = self.meta["reject_below"]
+        self.accept_at_least = self.meta["accept_at_least"]
+        w = np.load(os.path.join(path, "weights.npy"))
+        self.text_weights = w[: self.hash_dim]
+        self.metadata_weights = w[self.hash_dim : -1]
+        self.bias = float(w[-1])
+
+    def score(self, text, posted_relative, num_prev):
+        """Logit of the message being ask-to-ask."""
+        return (
+            float(self.text_weights[features.hashed(text, self.hash_dim)].sum())
+            + float(self.metadata_weights @ features.metadata(len(text), posted_relative, num_prev))
+            + self.bias
+        )
+
+    def decide(self, text, posted_relative, num_prev):
+        """True or False if the message is confidently ask-to-ask or not, None to escalate it."""
+        s = self.score(text, posted_relative, num_prev)
+        if s < self.reject_below:
+            return False
+        elif self.accept_at_least is not None and s >= self.accept_at_least:
+            return True
+        return None
+
+
+if __name__ == "__main__":
+    build()
+    scorer = CascadeScorer()
+    print(f"Built the ask-to-ask cascade scorer in {CASCADE_DIR}")
+    print(json.dumps(scorer.meta["cross_validation"], indent=2))
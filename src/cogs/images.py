@@ -4,8 +4,8 @@
 
 from discord.ext import commands
 import discord
-import requests
 from bs4 import BeautifulSoup
+from net import http
 
 
 class ImageCommands(commands.Cog):
@@ -13,14 +13,14 @@ class ImageCommands(commands.Cog):
     def __init__(self, client):
         self.client = client
 
-    def search(self, q):
+    async def search(self, q):
         """Get an image URL for the given query and number of images."""
         url = "https://www.google.com/search"
         params = {
             'q': q,
             'tbm': 'isch'
         }
-        soup = BeautifulSoup(requests.get(url, params=params).text)
+        soup = BeautifulSoup(await http.get_text(url, params=params))
         return soup.select('a div img')[0]['src']
 
     @commands.command(name='img')
@@ -29,6 +29,6 @@ class ImageCommands(commands.Cog):
         async with ctx.typing():
             query = ' '.join(args)
             emb = discord.Embed()
-            emb.set_image(url=self.search(query))
+            emb.set_image(url=await self.search(query))
 
         await ctx.send(embed=emb)
@@ -4,9 +4,9 @@ import discord
 """This file provides Python bindings for the Merriam-Webster Dictionary API that correctly deal
 with the API's use of markup."""
 import re
-import requests
 from urllib.parse import quote
 import os
+from net import http
 
 
 def to_small_caps(text: str) -> str:
@@ -50,15 +50,16 @@ def to_superscript(text: str) -> str:
     return text.translate(SUPERSCRIPT_TRANS)
 
 
+MW_PUNCTUATION = {"ldquo": "\u201c", "rdquo": "\u201d", "bc": "**:** "}
+
+
 def replace_mw_punctuation(text: str) -> str:
     """Given input from the MW API, replaces the self-contained punctuation markup with its proper form.
     For instance, {ldquo} is replaced with the left quote character.
     """
-    return (
-        text.replace("{ldquo}", "\u201c")
-        .replace("{rdquo}", "\u201d")
-        .replace("{bc}", "**:** ")
-    )
+    for token, replacement in MW_PUNCTUATION.items():
+        text = text.replace("{" + token + "}", replacement)
+    return text
 
 
 TOKEN_TO_FUNC = {
@@ -74,34 +75,63 @@ TOKEN_TO_FUNC = {
     "qword": to_italics,
 }
 
-MW_GROUP_RE = re.compile(r"{(.+?)}(.*?){\/.*?}")
+# {tag}, {/tag} or {tag|field|...}
+MW_TOKEN_RE = re.compile(r"{(/?)([^{}|]*)((?:\|[^{}]*)?)}")
 
 
 def mw_to_markdown(text: str) -> str:
-    """Given input from the MW API, translates the markup to Markdown."""
-    new_text = replace_mw_punctuation(text)
-
-    def replace(match):
-        if match.group(1) in TOKEN_TO_FUNC:
-            return TOKEN_TO_FUNC[match.group(1)](match.group(2))
+    """Given input from the MW API, translates the markup to Markdown. Tags may be nested, and the
+    whole string is converted in a single pass over its tokens."""
+    if "{" not in text:
+        return text
+    # text, then (closing slash, tag name, |fields, text following the token) for each token
+    parts = MW_TOKEN_RE.split(text)
+    out = [parts[0]]
+    # (tag, output of the enclosing tag) for each tag that is still open
+    stack = []
+    for i in range(1, len(parts), 4):
+        closing, name, fields, after = parts[i : i + 4]
+        if closing:
+            if not stack:
+                out.append("{/" + name + fields + "}")
+            else:
+                if stack[-1][0] != name and any(tag == name for tag, _ in stack):
+                    # tags opened inside the one being closed and never closed are left as they were
+                    while stack[-1][0] != name:
+                        tag, parent = stack.pop()
+                        parent.append("{" + tag + "}" + "".join(out))
+                        out = parent
+                # close the matching tag, or the innermost one if none match
+                tag, parent = stack.pop()
+                if tag in TOKEN_TO_FUNC:
+                    parent.append(TOKEN_TO_FUNC[tag]("".join(out)))
+                # otherwise it's one of the tags we don't search for, probably a link: just remove
+                out = parent
+        elif fields:
+            # single-token markup like sx and a_link: keep the first field
+            out.append(fields.split("|", 2)[1])
+        elif name in MW_PUNCTUATION:
+            out.append(MW_PUNCTUATION[name])
         else:
-            # one of the tags we don't search for, probably a link: just remove
-            return ""
-
-    subbed = re.sub(MW_GROUP_RE, replace, new_text)
-    # now deal with single-quote markup like sx and a_link
-    return re.sub(r"{[^}|]+\|([^}|]*)[^}]*}", r"\1", subbed)
+            stack.append((name, out))
+            out = []
+        out.append(after)
+    while stack:
+        tag, parent = stack.pop()
+        parent.append("{" + tag + "}" + "".join(out))
+        out = parent
+    return "".join(out)
 
 
 BASEURL = "https://dictionaryapi.com/api/v3/references/collegiate/json/{}?key={}"
 
 
-def define(word):
+async def define(word):
     """Returns a list of definitions, with all of the data still there."""
-    j = requests.get(BASEURL.format(quote(word), os.environ['MW_DICT_KEY'])).json()
+    j = await http.get_json(BASEURL.format(quote(word), os.environ['MW_DICT_KEY']))
     if j and isinstance(j[0], str):
         # gave us a list of suggestions back, try first one
-        return define(j[0])
+        return await define(j[0])
     elif not j:
         return []
     else:
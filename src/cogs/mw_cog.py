@@ -4,30 +4,39 @@
 from discord.ext import commands
 from .mw import define, mw_to_markdown
 import discord
-from constants import NAME
+from constants import MW_CACHE_PATH, STATE_PATH
+from cache import TTLCache
+from outbound import scheduler
 import logging
 
+# headword, exactly as looked up -> the API's definitions and their rendered embeds (as dicts)
+entries = TTLCache(
+    maxsize=512, ttl=7 * 24 * 60 * 60, path=MW_CACHE_PATH, table="mw_entries"
+)
+
 
 def get_all_senses(tree):
-    """Given a JSON definition tree, recurse, returning an ordered list of all of the senses."""
+    """Given a JSON definition tree, returns an ordered list of all of the senses."""
     senses = []
-    if isinstance(tree, list):
-        # check for single sense
-        if len(tree) == 2 and tree[0] == "sense":
-            senses.append(tree)
-        elif len(tree) == 2 and tree[0] == "bs":
-            # these are weird idk why
-            _, sense_dict = tree
-            if "sense" in sense_dict:
-                senses.append(["sense", sense_dict["sense"]])
-        else:
-            # otherwise, check sublists
-            for el in tree:
-                senses += get_all_senses(el)
-    elif isinstance(tree, dict):
-        # map type like sseq, recurse on values
-        for value in tree.values():
-            senses += get_all_senses(value)
+    # depth-first, with children pushed in reverse so they're visited in order
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, list):
+            # check for single sense
+            if len(node) == 2 and node[0] == "sense":
+                senses.append(node)
+            elif len(node) == 2 and node[0] == "bs":
+                # these are weird idk why
+                _, sense_dict = node
+                if "sense" in sense_dict:
+                    senses.append(["sense", sense_dict["sense"]])
+            else:
+                # otherwise, check sublists
+                stack.extend(reversed(node))
+        elif isinstance(node, dict):
+            # map type like sseq, check values
+            stack.extend(reversed(list(node.values())))
     return senses
 
 
@@ -65,42 +74,91 @@ def def_to_embed(dfn):
     return embed
 
 
+# words with no definitions are cached only this long, in case the API was briefly wrong
+EMPTY_TTL = 60 * 60
+
+
+def normalize(word):
+    """word with its whitespace collapsed. Case is kept: define only returns the entries whose
+    headword is exactly the word asked for, so "Set" and "set" get different answers."""
+    return " ".join(word.split())
+
+
+async def lookup(word):
+    """Returns the definition embeds for word, fetching and rendering them only on a cache miss.
+    Misspellings are cached under the misspelled word, so redirects only hit the API once."""
+    word = normalize(word)
+    entry = entries.get(word)
+    if entry is None:
+        defs = await define(word)
+        embeds = [def_to_embed(d) for d in defs]
+        entry = {"defs": defs, "embeds": [emb.to_dict() for emb in embeds if emb.fields]}
+        entries.set(word, entry, ttl=None if entry["embeds"] else EMPTY_TTL)
+    return [discord.Embed.from_dict(emb) for emb in entry["embeds"]]
+
+
 class MWCommands(commands.Cog):
     def __init__(self, client):
         self.client = client
-        self.definitions = {}
+        # message id -> [word, page shown]; the pages themselves are re-rendered from entries
+        self.definitions = TTLCache(
+            maxsize=1024,
+            ttl=24 * 60 * 60,
+            path=STATE_PATH,
+            table="mw_pages",
+            # a lost write here is a message that stops responding, so they're never batched
+            commit_every=1,
+        )
 
     @commands.Cog.listener()
-    async def on_reaction_add(self, rxn, user):
-        msg = rxn.message
-        if user.name == NAME:
+    async def on_raw_reaction_add(self, payload):
+        # raw, so that pages sent before a restart (and no longer in discord.py's message cache)
+        # still turn
+        if payload.user_id == self.client.user.id:
             return
-        elif msg.id in self.definitions:
-            i, defs = self.definitions[msg.id]
-            if str(rxn) == "⬅":
-                new_i = (i - 1) % len(defs)
-            elif str(rxn) == "\u27a1":
-                new_i = (i + 1) % len(defs)
-            else:
-                new_i = i
-
-            if new_i != i:
-                self.definitions[msg.id] = (new_i, defs)
-                await msg.edit(
-                    embed=defs[new_i].set_footer(text=f"{new_i+1}/{len(defs)}")
-                )
+        key = str(payload.message_id)
+        if key not in self.definitions:
+            return
+        if str(payload.emoji) == "⬅":
+            step = -1
+        elif str(payload.emoji) == "\u27a1":
+            step = 1
+        else:
+            return
+        word, i = self.definitions.get(key)
+        defs = await lookup(word)
+        if not defs:
+            return
+        new_i = (i + step) % len(defs)
+        if new_i != i:
+            self.definitions.set(key, [word, new_i])
+            channel = self.client.get_channel(
+                payload.channel_id
+            ) or await self.client.fetch_channel(payload.channel_id)
+            await channel.get_partial_message(payload.message_id).edit(
+                embed=defs[new_i].set_footer(text=f"{new_i+1}/{len(defs)}")
+            )
 
     @commands.command()
     async def define(self, ctx, *args):
         """Give all of the definitions of a word, using Merriam Webster's dictionary."""
         async with ctx.typing():
             word = " ".join(args)
-            text = [def_to_embed(d) for d in define(word)]
-            text = [emb for emb in text if emb.fields]
+            text = await lookup(word)
         if text:
             msg = await ctx.send(embed=text[0].set_footer(text=f"1/{len(text)}"))
-            self.definitions[msg.id] = (0, text)
-            await msg.add_reaction("⬅")
-            await msg.add_reaction("\u27a1")
+            self.definitions.set(str(msg.id), [word, 0])
+            scheduler.react(msg, "⬅")
+            scheduler.react(msg, "\u27a1")
         else:
             await ctx.send("Couldn't find definition. Sorry! >_<")
+
+    @commands.command()
+    @commands.is_owner()
+    async def mwcache(self, ctx):
+        """Show the definition cache's hit and miss counts."""
+        stats = entries.stats()
+        await ctx.send(
+            f"{stats['size']} cached, {stats['hits']} hits, {stats['misses']} misses "
+            f"({stats['hit_rate']:.0%} hit rate)"
+        )
@@ -5,16 +5,22 @@ from discord.ext import commands
 import discord
 import json
 import typing
+from registry import registry
 
-res = ""
-with open('resources/resources.json', 'r') as infile:
-    res = json.load(infile)
+
+def load_resources():
+    with open('resources/resources.json', 'r') as infile:
+        return json.load(infile)
+
+
+registry.register("resources", load_resources)
 
 class ResourcesCommands(commands.Cog):
     def __init__(self, client):
         self.client = client
 
     async def help_list(self, ctx):
+        res = registry.get("resources")
         await ctx.send("Available resource headings (use `Nano, resources {header}`):\n" +
                        '\n'.join(res.keys()))
 
@@ -24,6 +30,7 @@ class ResourcesCommands(commands.Cog):
          - general, math, or writing, to show those pages
          - list to show all page headers
          - nothing to show all resources"""
+        res = registry.get("resources")
         if subj is None:
             for subj in res:
                 await self.help(ctx, subj)
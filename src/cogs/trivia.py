@@ -2,55 +2,177 @@
 
 """Cog to support trivia puzzles."""
 from discord.ext import commands
-import requests
 import logging
 import random
 import html
 import asyncio
-from constants import NAME
+import typing
+from collections import defaultdict, deque
+from cache import TTLCache
+from constants import STATE_PATH, TRIVIA_URL
+from net import http
+from outbound import scheduler
+from ratelimit import TokenBucket
+
+# opentdb response codes
+SUCCESS = 0
+NO_RESULTS = 1
+INVALID_PARAMETER = 2
+TOKEN_NOT_FOUND = 3
+TOKEN_EMPTY = 4
+RATE_LIMITED = 5
+
+DIFFICULTIES = ("easy", "medium", "hard")
+
+
+class QuestionPool:
+    """Multiple-choice questions from opentdb, buffered per (category, difficulty) so they are
+    served from memory. Whenever a buffer falls below low_water it is refilled in the background
+    with batch questions at a time. The session token, which keeps opentdb from repeating questions,
+    is renewed when it expires and reset when it runs out of questions."""
+
+    def __init__(self, base_url=TRIVIA_URL, batch=50, low_water=10, requests_per_second=0.2):
+        self.base_url = base_url.rstrip("/")
+        self.batch = batch
+        self.low_water = low_water
+        # opentdb allows one request every five seconds from each IP
+        self.budget = TokenBucket(requests_per_second, capacity=1)
+        self.token = None
+        self.buffers = defaultdict(deque)
+        self.refills = {}
+
+    async def request(self, path, params):
+        await self.budget.acquire()
+        return await http.get_json(f"{self.base_url}/{path}", params=params)
+
+    async def new_token(self):
+        j = await self.request("api_token.php", {"command": "request"})
+        self.token = j["token"]
+
+    async def reset_token(self):
+        """Makes every question available to the token again."""
+        j = await self.request("api_token.php", {"command": "reset", "token": self.token})
+        if j["response_code"] != SUCCESS:
+            await self.new_token()
+
+    async def fetch(self, category, difficulty):
+        """Returns up to batch questions the token hasn't seen, or [] if opentdb has none."""
+        amount = self.batch
+        for _ in range(8):
+            if self.token is None:
+                await self.new_token()
+            params = {"amount": amount, "type": "multiple", "token": self.token}
+            if category is not None:
+                params["category"] = category
+            if difficulty is not None:
+                params["difficulty"] = difficulty
+            j = await self.request("api.php", params)
+            code = j["response_code"]
+            if code == SUCCESS:
+                return j["results"]
+            elif code == NO_RESULTS and amount > 1:
+                # fewer questions than that left for the query
+                amount //= 2
+            elif code == TOKEN_NOT_FOUND:
+                logging.info("Trivia token expired, requesting a new one")
+                self.token = None
+            elif code == TOKEN_EMPTY:
+                logging.info("Trivia token ran out of questions, resetting it")
+                await self.reset_token()
+            elif code != RATE_LIMITED:
+                break
+        logging.error(
+            "Could not fetch trivia questions for %s: response code %d",
+            (category, difficulty),
+            code,
+        )
+        return []
+
+    async def fill(self, key):
+        try:
+            questions = await self.fetch(*key)
+        except Exception:
+            logging.exception("Failed to refill trivia questions for %s", key)
+            return
+        self.buffers[key].extend(questions)
+        logging.info("Fetched %d trivia questions for %s", len(questions), key)
+
+    def refill(self, key):
+        """Starts refilling key's buffer in the background, unless that's already under way."""
+        task = self.refills.get(key)
+        if task is None or task.done():
+            task = self.refills[key] = asyncio.ensure_future(self.fill(key))
+        return task
+
+    async def get(self, category=None, difficulty=None):
+        """Returns a question, or None if none could be fetched. Only waits on the network when
+        the buffer has run dry."""
+        key = (category, difficulty)
+        buffer = self.buffers[key]
+        if not buffer:
+            await self.refill(key)
+        question = buffer.popleft() if buffer else None
+        if len(buffer) < self.low_water:
+            self.refill(key)
+        return question
 
 
 class TriviaCommands(commands.Cog):
     def __init__(self, client):
         self.client = client
-        self.qs_with_answers = {}
+        self.pool = QuestionPool()
+        # message id -> index of the correct answer, for questions nobody has answered yet
+        self.qs_with_answers = TTLCache(
+            maxsize=1024,
+            ttl=24 * 60 * 60,
+            path=STATE_PATH,
+            table="trivia_answers",
+            # a lost write here is a message that stops responding, so they're never batched
+            commit_every=1,
+        )
         self.answer_choices = "🇦🇧🇨🇩"
 
     @commands.Cog.listener()
     async def on_ready(self):
-        r = requests.get("https://opentdb.com/api_token.php?command=request")
-        r.raise_for_status()
-        self.token = r.json()["token"]
+        self.pool.refill((None, None))
 
     @commands.Cog.listener()
-    async def on_reaction_add(self, rxn, user):
-        msg = rxn.message
-        if user.name == NAME:
+    async def on_raw_reaction_add(self, payload):
+        # raw, so that questions asked before a restart (and no longer in discord.py's message
+        # cache) can still be answered
+        if payload.user_id == self.client.user.id:
             return
-        elif msg.id in self.qs_with_answers:
-            correct_char = self.answer_choices[self.qs_with_answers[msg.id]]
-            if str(rxn) == correct_char:
-                del self.qs_with_answers[msg.id]
-                await msg.channel.send("Correct, good job {}!".format(user.mention))
+        key = str(payload.message_id)
+        if key in self.qs_with_answers:
+            correct_char = self.answer_choices[self.qs_with_answers.get(key)]
+            if str(payload.emoji) == correct_char:
+                self.qs_with_answers.delete(key)
+                channel = self.client.get_channel(
+                    payload.channel_id
+                ) or await self.client.fetch_channel(payload.channel_id)
+                await channel.send("Correct, good job <@{}>!".format(payload.user_id))
 
     @commands.command()
-    async def trivia(self, ctx):
-        """Show a trivia question."""
-        # TODO support more features
-        r = requests.get(
-            f"https://opentdb.com/api.php?amount=1&type=multiple&token={self.token}"
-        )
-        json = r.json()
-        logging.info(json)
-        if json["response_code"] != 0:
+    async def trivia(
+        self,
+        ctx,
+        category: typing.Optional[int] = None,
+        difficulty: typing.Optional[str] = None,
+    ):
+        """Show a trivia question, optionally from an opentdb category number and of a difficulty
+        (easy, medium or hard)."""
+        if difficulty is not None and difficulty.lower() not in DIFFICULTIES:
+            await ctx.send(f"Difficulty must be one of {', '.join(DIFFICULTIES)}!")
+            return
+        q = await self.pool.get(category, difficulty and difficulty.lower())
+        if q is None:
             await ctx.send("There was an error!")
         else:
-            q = json["results"][0]
             logging.info(q)
             cor_answer = q["correct_answer"]
             inc_answers = q["incorrect_answers"]
             num_ans = len(inc_answers) + 1
-            answers = inc_answers
+            answers = list(inc_answers)
             correct_answer_num = random.randrange(num_ans)
             answers.insert(correct_answer_num, cor_answer)
             text = f"{html.unescape(q['question'])}"
@@ -58,5 +180,6 @@ class TriviaCommands(commands.Cog):
                 text += f"\n{choice} → {html.unescape(answer)}"
 
             msg = await ctx.send(text)
-            self.qs_with_answers[msg.id] = correct_answer_num
-            await asyncio.gather(*[msg.add_reaction(c) for c in self.answer_choices])
+            self.qs_with_answers.set(str(msg.id), correct_answer_num)
+            for c in self.answer_choices:
+                scheduler.react(msg, c)
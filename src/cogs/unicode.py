@@ -4,18 +4,11 @@
 
 from discord.ext import commands
 import discord
-import pandas as pd
 import tabulate
-import unicodedata
-from fuzzywuzzy import process
+from unicode_index import UnicodeIndex
+from registry import registry
 
-UDATA = "https://raw.githubusercontent.com/latex3/unicode-data/main/UnicodeData.txt"
-df = pd.read_csv(
-    UDATA,
-    sep=';',
-    names=['code', 'name', 'category', 'combining_class', 'bidi_category', 'digit10', 'digit',
-           'numeric', 'mirrored', 'old_name', 'comment', 'upper', 'lower', 'title'],
-    index_col=False)
+registry.register("unicode_index", UnicodeIndex)
 
 
 class UnicodeCommands(commands.Cog):
@@ -34,9 +27,9 @@ class UnicodeCommands(commands.Cog):
                 limit = 3
                 query = ' '.join(args)
 
-            results = process.extract(query, df['name'], limit=limit)
+            results = registry.get("unicode_index").search(query, limit=limit)
             output = [('Name', 'Code', 'Character')]
-            for name, score, i in results:
-                output.append((name, df.loc[i, 'code'], unicodedata.lookup(name)))
+            for name, code, score in results:
+                output.append((name, f'{code:04X}', chr(code)))
 
         await ctx.send('```\n' + tabulate.tabulate(output, tablefmt='simple') + '\n```')
@@ -3,8 +3,9 @@
 from discord.ext import commands
 import discord
 import os
-import requests
 import re
+import aiohttp
+from net import http
 
 
 class WeatherCommands(commands.Cog):
@@ -28,24 +29,24 @@ class WeatherCommands(commands.Cog):
             query = ' '.join(args)
             if ',' in query:  # split into list so the comma makes it into the query
                 query = query.split(',')
-            r = requests.get(self.BASE_URL, timeout=0.5,
-                             params={'q': query, 'appid': self.KEY, 'units': 'metric'})
-        if r.status_code != requests.codes.ok:
-            await ctx.send("Could not complete query. Sorry!")
-            r.raise_for_status()
+            params = [('q', q) for q in (query if type(query) == list else [query])]
+            params += [('appid', self.KEY), ('units', 'metric')]
+            try:
+                j = await http.get_json(self.BASE_URL, params=params, timeout=0.5)
+            except aiohttp.ClientResponseError:
+                await ctx.send("Could not complete query. Sorry!")
+                raise
+        if type(query) == list:
+            q = ', '.join(query)
         else:
-            j = r.json()
-            if type(query) == list:
-                q = ', '.join(query)
-            else:
-                q = query
+            q = query
 
-            embed = discord.Embed(title=f'Weather in {q}', type='rich',
-                                  colour=0x000763)
-            embed.set_image(url=self.ICON_URL.format(code=j['weather'][0]['icon']))
-            embed.add_field(name='Conditions',
-                            value=j['weather'][0]['description'].capitalize())
-            embed.add_field(name='Feels Like',
-                            value=self.format_temp(j['main']['feels_like']))
-            embed.set_footer(text='Data courtesy of OpenWeatherMap')
-            await ctx.send(embed=embed)
+        embed = discord.Embed(title=f'Weather in {q}', type='rich',
+                              colour=0x000763)
+        embed.set_image(url=self.ICON_URL.format(code=j['weather'][0]['icon']))
+        embed.add_field(name='Conditions',
+                        value=j['weather'][0]['description'].capitalize())
+        embed.add_field(name='Feels Like',
+                        value=self.format_temp(j['main']['feels_like']))
+        embed.set_footer(text='Data courtesy of OpenWeatherMap')
+        await ctx.send(embed=embed)
@@ -3,12 +3,58 @@
 import typing
 import discord
 import logging
-import wikipedia
 import re
 from discord.ext import commands
+from net import http
 
 """Cog to support wikipedia functionality."""
 
+API_URL = "https://en.wikipedia.org/w/api.php"
+
+
+class DisambiguationError(Exception):
+    """The title is a disambiguation page."""
+
+
+class PageError(Exception):
+    """No page has the given title."""
+
+
+async def query(**params):
+    """Makes a MediaWiki API query and returns the JSON response."""
+    params.update(action="query", format="json")
+    return await http.get_json(API_URL, params=params)
+
+
+async def search(term):
+    """Titles of the pages best matching term, best first."""
+    j = await query(list="search", srsearch=term, srprop="", srlimit=10)
+    return [result["title"] for result in j["query"]["search"]]
+
+
+async def suggest(term):
+    """Wikipedia's spelling suggestion for term, or None."""
+    j = await query(list="search", srsearch=term, srinfo="suggestion", srprop="")
+    return j["query"].get("searchinfo", {}).get("suggestion")
+
+
+async def summary(title, sentences):
+    """The first sentences of the plain-text page with the given title, following redirects."""
+    j = await query(
+        prop="extracts|pageprops",
+        ppprop="disambiguation",
+        explaintext="",
+        exsentences=sentences,
+        redirects="",
+        titles=title,
+    )
+    page = next(iter(j["query"]["pages"].values()))
+    if "missing" in page or "invalid" in page:
+        raise PageError(title)
+    elif "disambiguation" in page.get("pageprops", {}):
+        raise DisambiguationError(title)
+    return page.get("extract", "")
+
 
 class WikiCommands(commands.Cog):
     def __init__(self, client):
@@ -25,24 +71,24 @@ class WikiCommands(commands.Cog):
             else:
                 search_term = " ".join(args)
             logging.info(search_term)
-            searched = wikipedia.search(f"{search_term}")
+            searched = await search(f"{search_term}")
             if searched:
                 suggested = searched[0]
             else:
-                suggested = wikipedia.suggest(search_term)
+                suggested = await suggest(search_term)
 
             logging.info(suggested)
             try:
-                text = wikipedia.summary(
-                    suggested, sentences=sentences, auto_suggest=False
-                )
+                if suggested is None:
+                    raise PageError(search_term)
+                text = await summary(suggested, sentences=sentences)
                 # MediaWiki has some super messed up formatting problems with TeX, do my best to
                 # paper over the gaping maw of the problems with this format
                 text = re.sub(r'\n +', '', text)
                 text = re.sub(r'(\w+)\{.*\}', r'\1', text)
                 text = text.replace('\n', '\n\n')
-            except wikipedia.exceptions.DisambiguationError:
+            except DisambiguationError:
                 text = "Your query wasn't specific enough."
-            except wikipedia.exceptions.PageError:
+            except PageError:
                 text = "Page not found, try again."
         await ctx.send(text)
@@ -1,5 +1,62 @@
 #!/usr/bin/env python3
 
 """Global constants."""
+import os
 
 NAME = "Nano"
+
+A2A_MODEL = "textcat_demo/training/model-best"
+# "1" has A2AFilter first run the cheap scorer in cascade.py, only asking the model about the
+# messages it isn't confident about. Off by default, since how often the cascade agrees with the
+# model alone has not been measured (bench/cascade.py does, given the model's weights)
+A2A_CASCADE = os.environ.get("NANO_A2A_CASCADE", "0") == "1"
+# what runs the ask-to-ask model in the NLP workers: "spacy", the pipeline in A2A_MODEL, or "student",
+# the NumPy-only student exported from it by a2a_student.py
+A2A_BACKEND = os.environ.get("NANO_A2A_BACKEND", "spacy")
+# SQLite file the model's results are cached in across restarts; unset to cache in memory only
+A2A_CACHE_PATH = os.environ.get("NANO_A2A_CACHE")
+
+# CPU-bound NLP work (model inference, language detection, fuzzy search) runs in this many worker
+# processes; 0 runs it on a single thread in the bot process instead
+NLP_WORKERS = int(os.environ.get("NANO_NLP_WORKERS", "2"))
+# at most this many jobs may be queued or running at once...
+NLP_MAX_PENDING = int(os.environ.get("NANO_NLP_MAX_PENDING", "64"))
+# ...beyond which new jobs are either skipped ("skip") or wait for a free slot ("wait")
+NLP_SATURATION_POLICY = os.environ.get("NANO_NLP_POLICY", "skip")
+
+# SQLite file the state of interactive messages (definition pages, open trivia questions) is kept in
+# across restarts; unset to keep it in memory only
+STATE_PATH = os.environ.get("NANO_STATE_DB")
+
+# how ForeignLangFilter tells what language a message is in: "ngram", the deterministic n-gram table
+# in langid.py, or "langdetect", whose random sampling is seeded with LANGDETECT_SEED
+LANGUAGE_DETECTOR = os.environ.get("NANO_LANGUAGE_DETECTOR", "ngram")
+LANGDETECT_SEED = 0
+
+# port to serve Prometheus metrics on at /metrics; unset to not serve them
+METRICS_PORT = os.environ.get("NANO_METRICS_PORT")
+
+# how long messages are remembered for RepostFilter to notice them posted again in another channel,
+# in seconds, and roughly how much memory they may take, in bytes
+REPOST_WINDOW = int(os.environ.get("NANO_REPOST_WINDOW", 10 * 60))
+REPOST_MEMORY = int(os.environ.get("NANO_REPOST_MEMORY", 32 * 2 ** 20))
+
+# how many users (per channel, or per person they ping) the rate-based filters keep exact counts for;
+# any more are counted approximately, in a fixed amount of memory
+RATE_KEYS = int(os.environ.get("NANO_RATE_KEYS", 10000))
+
+# Open Trivia Database server trivia questions come from
+TRIVIA_URL = os.environ.get("NANO_TRIVIA_URL", "https://opentdb.com")
+
+# SQLite file Merriam-Webster lookups are cached in across restarts; unset to cache in memory only
+MW_CACHE_PATH = os.environ.get("NANO_MW_CACHE")
+
+# service ForeignLangFilter translates with: "googletrans", or "stub" to make no requests
+TRANSLATION_BACKEND = os.environ.get("NANO_TRANSLATION_BACKEND", "googletrans")
+# SQLite file translations are cached in across restarts; unset to cache in memory only
+TRANSLATION_CACHE_PATH = os.environ.get("NANO_TRANSLATION_CACHE")
+
+# scraped messages and the scraper's progress are kept here
+SCRAPE_DIR = os.environ.get("NANO_SCRAPE_DIR", "scrape")
+# ...and then stored as Parquet here, for training and analysis
+STORE_DIR = os.environ.get("NANO_STORE_DIR", "store")
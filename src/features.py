@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+
+"""Features of messages for the ask-to-ask models that run without spaCy: hashed word n-grams of the
+text, and the metadata the analysis notebook found to be predictive (message length, minutes since
+the author joined, and how many messages they had posted before)."""
+import math
+import re
+import zlib
+import numpy as np
+from utils import user_joined
+
+# number of buckets word n-grams are hashed into
+HASH_DIM = 2 ** 12
+METADATA = ("length", "posted_relative", "num_prev")
+
+WORD_RE = re.compile(r"[a-z0-9']+|[?!]")
+
+
+def words(text):
+    """Lowercased words of text, with question and exclamation marks as words of their own."""
+    return WORD_RE.findall(text.lower())
+
+
+def ngrams(text):
+    """Word unigrams and bigrams of text, with the first word also marked as such, since asking to
+    ask mostly shows at the start of a message."""
+    ws = words(text)
+    grams = list(ws)
+    grams.extend(f"{a} {b}" for a, b in zip(ws, ws[1:]))
+    if ws:
+        grams.append(f"^ {ws[0]}")
+    return grams
+
+
+def affixes(text):
+    """ngrams of text, plus the first and last three letters of each word, which make up for
+    misspellings and inflections much like spaCy's PREFIX and SUFFIX features."""
+    grams = ngrams(text)
+    for w in words(text):
+        if len(w) > 3:
+            grams.append(f"{w[:3]}-")
+            grams.append(f"-{w[-3:]}")
+    return grams
+
+
+def hashed(text, dim=HASH_DIM, grams=ngrams):
+    """Sorted indices of the hash buckets text's grams fall in, each once."""
+    return np.unique(
+        np.fromiter(
+            (zlib.crc32(g.encode("utf-8")) % dim for g in grams(text)), dtype=np.int64
+        )
+    )
+
+
+def metadata(length, posted_relative, num_prev):
+    """METADATA on a log scale, since all of them are heavy-tailed. posted_relative is in minutes."""
+    return np.array(
+        [
+            math.log1p(length),
+            math.log1p(max(posted_relative, 0.0)),
+            math.log1p(num_prev),
+        ],
+        dtype=np.float32,
+    )
+
+
+def posted_relative(message):
+    """Minutes between the author joining the guild and posting message, or 0 if that's unknown."""
+    joined = user_joined(message.author)
+    if joined is None:
+        return 0.0
+    return (message.created_at - joined).total_seconds() / 60
@@ -3,43 +3,210 @@
 """This file defines message filters: automated tests that are applied to each message sent,
 triggering some corresponding action."""
 import discord
-from langdetect import detect_langs
-from googletrans import Translator, LANGUAGES
 from utils import user_joined
-import spacy
 import datetime
 import logging
-from constants import NAME
+from constants import NAME, A2A_CASCADE, LANGUAGE_DETECTOR, RATE_KEYS
+from keywords import KeywordMatcher
+from a2a import BatchClassifier
+from workers import pool, detect_languages
+from registry import registry
+from metrics import metrics
+from outbound import scheduler, PRIORITY_MODERATION, PRIORITY_NORMAL, PRIORITY_FUN
+from translation import translator, probably_english
+from repost import repost_index
+from rates import RateCounter
+from features import posted_relative
 import re
+from collections import defaultdict
 
-nlp = spacy.load("en_core_web_sm")
-a2a_nlp = spacy.load("textcat_demo/training/model-best")
+a2a_classifier = BatchClassifier(pool)
+
+
+def load_langid():
+    from langid import NgramLanguageModel
+
+    return NgramLanguageModel()
+
+
+registry.register("langid", load_langid)
+
+
+def load_a2a_cascade():
+    from cascade import CascadeScorer
+
+    return CascadeScorer()
+
+
+registry.register("a2a_cascade", load_a2a_cascade)
+
+
+class LanguageDetector:
+    """Way of telling which languages a text is in. A non-English language at least threshold
+    probable makes ForeignLangFilter translate the message."""
+
+    threshold = 0.99
+
+    async def detect(self, text):
+        """Returns the languages of text as objects with lang and prob attributes, most probable
+        first, or None if they couldn't be computed right now."""
+        raise NotImplementedError()
+
+
+class LangdetectDetector(LanguageDetector):
+    """langdetect, run in the NLP workers. Its sampling is seeded, so results are reproducible."""
+
+    async def detect(self, text):
+        return await pool.run(detect_languages, text)
+
+
+class NgramDetector(LanguageDetector):
+    """Deterministic n-gram table from langid.py. It takes well under a millisecond, so it runs
+    right in the bot process."""
+
+    async def detect(self, text):
+        with metrics.timer("language_detect_seconds", detector="ngram"):
+            return registry.get("langid").detect(text)
+
+
+LANGUAGE_DETECTORS = {"langdetect": LangdetectDetector, "ngram": NgramDetector}
+language_detector = LANGUAGE_DETECTORS[LANGUAGE_DETECTOR]()
+
+# Relative cost of evaluating a filter, used by ComboFilter to run cheap checks before expensive ones
+# so that a failing cheap check skips the rest.
+COST_TRIVIAL = 0  # attribute lookups on the message itself
+COST_CHEAP = 1  # scans over the message content
+COST_MODEL = 2  # local model inference
+COST_NETWORK = 3  # Discord API or other network round trips
+
+# every phrase any filter looks for, so each message is scanned for all of them in one pass
+KEYWORDS = KeywordMatcher()
+
+
+class MessageContext:
+    """Facts derived from a single message, shared by every filter evaluated on it. Each fact is
+    computed at most once per message, however many filter trees ask for it."""
+
+    def __init__(self, message):
+        self.message = message
+        self._memo = {}
+
+    def memo(self, key, compute):
+        """Returns the value stored under key, calling compute() to produce it the first time."""
+        if key not in self._memo:
+            self._memo[key] = compute()
+        return self._memo[key]
+
+    async def amemo(self, key, compute):
+        """Like memo, but compute() returns an awaitable."""
+        if key not in self._memo:
+            self._memo[key] = await compute()
+        return self._memo[key]
+
+    @property
+    def content_lower(self):
+        return self.memo("content_lower", self.message.content.lower)
+
+    @property
+    def phrases(self):
+        """The phrases registered with KEYWORDS that occur in the lowercased message."""
+        return self.memo("phrases", lambda: KEYWORDS.scan(self.content_lower))
+
+    async def reply_to(self):
+        """The message this one replies to, or None if it isn't a reply."""
+
+        async def fetch():
+            ref = getattr(self.message, "reference", None)
+            if ref is None:
+                return None
+            return await self.message.channel.fetch_message(ref.message_id)
+
+        return await self.amemo("reply_to", fetch)
+
+    def is_watched(self, channel_prefs):
+        """Whether the message was sent in a DM or a channel starting with one of channel_prefs."""
+        channel = self.message.channel
+        return self.memo(
+            ("watched", tuple(channel_prefs)),
+            lambda: type(channel) == discord.DMChannel
+            or any(channel.name.startswith(pref) for pref in channel_prefs),
+        )
+
+    async def a2a_cats(self):
+        """The ask-to-ask classifier's category scores for the message, or None if the NLP workers
+        were too busy to compute them."""
+
+        return await self.amemo(
+            "a2a_cats", lambda: a2a_classifier.classify(self.content_lower)
+        )
+
+    @property
+    def probably_english(self):
+        """Whether the message is plainly English, which is far cheaper to tell than languages."""
+        return self.memo("probably_english", lambda: probably_english(self.message.content))
+
+    async def languages(self):
+        """The languages language_detector finds in the message, most probable first, or None if
+        they couldn't be computed right now."""
+        return await self.amemo(
+            "languages", lambda: language_detector.detect(self.message.content)
+        )
 
 
 class MessageFilter:
     """Specific way of filtering messages and handling them accordingly."""
 
-    async def matches(self, message):
+    cost = COST_CHEAP
+    # phrases this filter looks up in MessageContext.phrases
+    phrases = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        KEYWORDS.add(*cls.phrases)
+
+    @property
+    def name(self):
+        """Name the filter's metrics are recorded under."""
+        return type(self).__name__
+
+    async def matches(self, message, context):
         raise NotImplementedError()
 
-    async def respond(self, message):
+    async def respond(self, message, context):
+        pass
+
+    def reset(self):
+        """Forgets anything the filter remembers from earlier messages."""
         pass
 
+    def requirements(self):
+        """Cheap necessary conditions for this filter to match, used by FilterIndex to skip it
+        without evaluating it. Recognized keys:
+         - channel_prefs: the message is in a DM or a channel starting with one of these
+         - addressed: the message is a reply or mentions someone
+         - phrases: the lowercased message contains at least one of these"""
+        return {}
+
 
 class WatchedChannelFilter(MessageFilter):
     """Filter for general and academic-help channels only."""
 
+    cost = COST_TRIVIAL
+
     def __init__(self, channel_prefs):
         self.channel_prefs = channel_prefs
 
-    async def matches(self, message):
-        return type(message.channel) == discord.DMChannel or any(
-            [message.channel.name.startswith(pref) for pref in self.channel_prefs]
-        )
+    async def matches(self, message, context):
+        return context.is_watched(self.channel_prefs)
+
+    def requirements(self):
+        return {"channel_prefs": tuple(self.channel_prefs)}
 
 
 class RecentJoinFilter(MessageFilter):
-    async def matches(self, message):
+    cost = COST_TRIVIAL
+
+    async def matches(self, message, context):
         joined = user_joined(message.author)
         return joined is not None and (
             message.created_at - joined
@@ -47,26 +214,62 @@ class RecentJoinFilter(MessageFilter):
 
 
 class A2AFilter(MessageFilter):
-    """Filter for ask-to-ask messages."""
-
-    async def matches(self, message):
-        cats = a2a_nlp(message.content.lower()).cats
-        return cats["BAD"] * 100 > cats["GOOD"]
+    """Filter for ask-to-ask messages. With cascade, the scorer in cascade.py decides the messages
+    it is confident about, and only the rest go to the model."""
+
+    cost = COST_MODEL
+
+    def __init__(self, cascade=A2A_CASCADE):
+        self.cascade = cascade
+        # messages each author posted lately, for the scorer's num_prev; it only sees authors who
+        # just joined, so a window a little longer than RecentJoinFilter's covers everything
+        self.counts = RateCounter(10 * 60, max_keys=RATE_KEYS)
+
+    def reset(self):
+        self.counts.clear()
+
+    def prescreen(self, message, context):
+        """The scorer's verdict on the message: True or False, or None if it should escalate."""
+        num_prev = (
+            self.counts.add(
+                (getattr(message.guild, "id", None), message.author.id),
+                message.created_at.timestamp(),
+            )
+            - 1
+        )
+        verdict = registry.get("a2a_cascade").decide(
+            message.content, posted_relative(message), num_prev
+        )
+        decision = {None: "escalated", True: "accepted", False: "rejected"}[verdict]
+        metrics.inc("a2a_cascade_total", decision=decision)
+        return verdict
+
+    async def matches(self, message, context):
+        if self.cascade:
+            verdict = context.memo(
+                ("a2a_prescreen", id(self)), lambda: self.prescreen(message, context)
+            )
+            if verdict is not None:
+                return verdict
+        cats = await context.a2a_cats()
+        return cats is not None and cats["BAD"] * 100 > cats["GOOD"]
 
-    async def respond(self, message):
+    async def respond(self, message, context):
         if message.guild.name == "Homework Help Voice":
-            await message.add_reaction("<:snoo_disapproval:808077416501215232>")
+            emoji = "<:snoo_disapproval:808077416501215232>"
         else:
-            await message.add_reaction("🤨")
+            emoji = "🤨"
+        scheduler.react(message, emoji, PRIORITY_MODERATION)
 
 
 class MentionOrReply(MessageFilter):
-    async def matches(self, message):
+    cost = COST_NETWORK
+
+    async def matches(self, message, context):
         if message.author.name == NAME:
             return False
         elif hasattr(message, "reference") and message.reference is not None:
-            ref = message.reference.message_id
-            ref_msg = await message.channel.fetch_message(ref)
+            ref_msg = await context.reply_to()
             if ref_msg.author.name == NAME:
                 logging.info(ref_msg)
                 logging.info(ref_msg, ref_msg.author)
@@ -77,94 +280,321 @@ class MentionOrReply(MessageFilter):
         else:
             return any(member.name == "Nano" for member in message.mentions)
 
+    def requirements(self):
+        return {"addressed": True}
+
 
 class IsThankYou(MessageFilter):
-    async def matches(self, message):
-        return any(
-            word in message.content.lower() for word in ("thank", "thanks", "good bot")
-        )
+    phrases = ("thank", "thanks", "good bot")
 
-    async def respond(self, message):
-        await message.add_reaction("🥰")
+    async def matches(self, message, context):
+        return not context.phrases.isdisjoint(self.phrases)
+
+    def requirements(self):
+        return {"phrases": self.phrases}
+
+    async def respond(self, message, context):
+        scheduler.react(message, "🥰", PRIORITY_FUN)
 
 
 class IsScold(MessageFilter):
-    async def matches(self, message):
-        return any(word in message.content.lower() for word in ("bad bot",))
+    phrases = ("bad bot",)
+
+    async def matches(self, message, context):
+        return not context.phrases.isdisjoint(self.phrases)
+
+    def requirements(self):
+        return {"phrases": self.phrases}
 
-    async def respond(self, message):
-        await message.reply(
-            "https://tenor.com/view/nichijou-nano-silly-stupid-gif-20046613"
+    async def respond(self, message, context):
+        scheduler.reply(
+            message,
+            "https://tenor.com/view/nichijou-nano-silly-stupid-gif-20046613",
+            PRIORITY_FUN,
         )
 
 
 class AnyoneAgree(MessageFilter):
+    phrases = ("back me up",)
+
     def __init__(self, names, check_names=True):
         self.names = names
         self.check_names = check_names
 
-    async def matches(self, message):
+    async def matches(self, message, context):
         return (
             message.author is not None
             and (not self.check_names or message.author.name in self.names)
-            and "back me up" in message.content.lower()
+            and "back me up" in context.phrases
         )
 
-    async def respond(self, message):
-        await message.reply(
-            f"I completely agree with {message.author.display_name} on this one"
+    def requirements(self):
+        return {"phrases": self.phrases}
+
+    async def respond(self, message, context):
+        scheduler.reply(
+            message,
+            f"I completely agree with {message.author.display_name} on this one",
+            PRIORITY_FUN,
         )
 
 
 class ForeignLangFilter(MessageFilter):
-    translator = Translator()
+    cost = COST_MODEL
+    # math symbols: a message with three or more different ones is probably an equation
+    phrases = tuple("+-/*=$()")
 
-    async def matches(self, message):
+    async def matches(self, message, context):
         if len(message.content) <= 30:
             return False
         elif message.content.startswith("Nano, "):
             return False
         else:
-            math_syms = "+-/*=$()"
-            if sum([1 if sym in message.content else 0 for sym in math_syms]) >= 3:
+            if len(context.phrases.intersection(self.phrases)) >= 3:
                 return False
             # detect emotes: more than 8 numeric characters in a row
             if re.search("\\d" * 8, message.content):
                 return False
+            if context.probably_english:
+                return False
 
-            langs = detect_langs(message.content)
+            langs = await context.languages() or []
             if langs and langs[0].lang == "en":
                 # most likely match, continue
                 return False
             else:
-                return any([lang.lang != "en" and lang.prob > 0.99 for lang in langs])
+                return any(
+                    lang.lang != "en" and lang.prob > language_detector.threshold
+                    for lang in langs
+                )
 
-    async def respond(self, message):
+    async def respond(self, message, context):
         if message.content.startswith("Nano, translate"):
             content = message.content[len("Nano, translate"):]
         elif message.content.startswith("Nano, tl"):
             content = message.content[len("Nano, tl"):]
         else:
             content = message.content
-        translated = self.translator.translate(content)
+        translated = await translator.translate(content)
         if translated.src != "en":
-            lang = LANGUAGES.get(translated.src.lower(), "unknown")
-            await message.reply(
-                f"Translated from {lang.capitalize()}: {translated.text}"
+            lang = translator.language_name(translated.src)
+            scheduler.reply(
+                message,
+                f"Translated from {lang.capitalize()}: {translated.text}",
+                PRIORITY_NORMAL,
             )
 
 
+class RepostFilter(MessageFilter):
+    """Filter for messages their author already posted in another channel a few minutes ago."""
+
+    # shorter messages are too likely to be repeated by accident
+    min_length = 20
+
+    def __init__(self, index=repost_index):
+        self.index = index
+
+    def reset(self):
+        self.index.clear()
+
+    def original(self, message, context):
+        """The index entry of the earlier copy of message, if any. Every message checked is added to
+        the index, so this is computed once per message."""
+        return context.memo(
+            ("repost_of", id(self)),
+            lambda: self.index.check(
+                (message.guild.id, message.author.id),
+                message.id,
+                message.channel.id,
+                message.channel.name,
+                message.content,
+                message.created_at.timestamp(),
+            ),
+        )
+
+    async def matches(self, message, context):
+        if message.guild is None or len(message.content) < self.min_length:
+            return False
+        return self.original(message, context) is not None
+
+    async def respond(self, message, context):
+        original = self.original(message, context)
+        scheduler.reply(
+            message,
+            f"You already asked this in #{original.channel_name}, please keep it to one channel!",
+            PRIORITY_MODERATION,
+        )
+
+
+class ChannelOveruseFilter(MessageFilter):
+    """Filter for someone posting more than limit messages in one channel within window seconds.
+    Matches once, on the message that crosses the limit."""
+
+    cost = COST_TRIVIAL
+
+    def __init__(self, limit=15, window=120):
+        self.limit = limit
+        self.counts = RateCounter(window, max_keys=RATE_KEYS)
+
+    def reset(self):
+        self.counts.clear()
+
+    async def matches(self, message, context):
+        if message.guild is None:
+            return False
+        count = context.memo(
+            ("channel_rate", id(self)),
+            lambda: self.counts.add(
+                (message.guild.id, message.author.id, message.channel.id),
+                message.created_at.timestamp(),
+            ),
+        )
+        return count == self.limit + 1
+
+    async def respond(self, message, context):
+        scheduler.reply(
+            message,
+            f"That's a lot of messages, {message.author.display_name}! Please give others a chance "
+            "to use this channel too.",
+            PRIORITY_MODERATION,
+        )
+
+
+class PingAbuseFilter(MessageFilter):
+    """Filter for someone pinging the same person more than limit times within window seconds, or
+    for someone being pinged more than target_limit times by anyone. Matches once per offence, on
+    the message that crosses a limit."""
+
+    cost = COST_TRIVIAL
+
+    def __init__(self, limit=4, target_limit=10, window=600):
+        self.limit = limit
+        self.target_limit = target_limit
+        self.by_pair = RateCounter(window, max_keys=RATE_KEYS)
+        self.by_target = RateCounter(window, max_keys=RATE_KEYS)
+
+    def reset(self):
+        self.by_pair.clear()
+        self.by_target.clear()
+
+    def abused(self, message):
+        """Counts the message's pings, returning the first person pinged past a limit, if any."""
+        now = message.created_at.timestamp()
+        abused = None
+        for member in message.mentions:
+            if member.id == message.author.id:
+                continue
+            pair = self.by_pair.add((message.guild.id, message.author.id, member.id), now)
+            target = self.by_target.add((message.guild.id, member.id), now)
+            if abused is None and (pair == self.limit + 1 or target == self.target_limit + 1):
+                abused = member
+        return abused
+
+    async def matches(self, message, context):
+        if message.guild is None or not message.mentions:
+            return False
+        return context.memo(("ping_abuse", id(self)), lambda: self.abused(message)) is not None
+
+    def requirements(self):
+        return {"addressed": True}
+
+    async def respond(self, message, context):
+        member = context.memo(("ping_abuse", id(self)), lambda: self.abused(message))
+        scheduler.reply(
+            message,
+            f"Please stop pinging {member.display_name} so much!",
+            PRIORITY_MODERATION,
+        )
+
+
 class ComboFilter(MessageFilter):
+    """Filter matching only if all of its children match. Children are evaluated cheapest first and
+    evaluation stops at the first one that fails."""
+
     def __init__(self, filters):
-        self.filters = filters
+        # sorted() is stable, so filters of equal cost keep the order they were given in
+        self.filters = tuple(sorted(filters, key=lambda f: f.cost))
+        self.cost = max((f.cost for f in self.filters), default=COST_TRIVIAL)
+
+    @property
+    def name(self):
+        return "+".join(f.name for f in self.filters)
 
-    async def matches(self, message):
-        matches = []
+    async def matches(self, message, context):
         for f in self.filters:
-            does_match = await f.matches(message)
-            matches.append(does_match)
-        return all(matches)
+            if not await evaluate(f, message, context):
+                return False
+        return True
+
+    async def respond(self, message, context):
+        for f in self.filters:
+            await f.respond(message, context)
 
-    async def respond(self, message):
+    def reset(self):
         for f in self.filters:
-            await f.respond(message)
+            f.reset()
+
+    def requirements(self):
+        # every child's requirements are necessary for the combination, so keep the first of each
+        reqs = {}
+        for f in self.filters:
+            for key, value in f.requirements().items():
+                reqs.setdefault(key, value)
+        return reqs
+
+
+async def evaluate(f, message, context):
+    """Returns whether f matches the message, recording how long it took to tell and the result."""
+    with metrics.timer("filter_seconds", filter=f.name):
+        matched = await f.matches(message, context)
+    metrics.inc("filter_evaluations_total", filter=f.name)
+    if matched:
+        metrics.inc("filter_matches_total", filter=f.name)
+    return matched
+
+
+class FilterIndex:
+    """Filters compiled into a lookup keyed by cheap features of a message (channel, whether it is
+    addressed to someone, trigger phrases), so that each message is only evaluated against the
+    filters that could possibly match it."""
+
+    def __init__(self, filters):
+        self.filters = tuple(filters)
+        reqs = [f.requirements() for f in self.filters]
+        self.channel_prefs = [r.get("channel_prefs") for r in reqs]
+        self.addressed = frozenset(i for i, r in enumerate(reqs) if r.get("addressed"))
+        self.by_phrase = defaultdict(set)
+        self.phraseless = set()
+        for i, r in enumerate(reqs):
+            if r.get("phrases"):
+                KEYWORDS.add(*r["phrases"])
+                for phrase in r["phrases"]:
+                    self.by_phrase[phrase].add(i)
+            else:
+                self.phraseless.add(i)
+        # channel name (None for DMs) -> indices of the filters allowed there
+        self.by_channel = {}
+
+    def channel_candidates(self, channel):
+        key = None if type(channel) == discord.DMChannel else getattr(channel, "name", "")
+        if key not in self.by_channel:
+            self.by_channel[key] = frozenset(
+                i
+                for i, prefs in enumerate(self.channel_prefs)
+                if prefs is None
+                or key is None
+                or any(key.startswith(pref) for pref in prefs)
+            )
+        return self.by_channel[key]
+
+    def candidates(self, message, context):
+        """The filters that could match the message, in their original order."""
+        cands = set(self.channel_candidates(message.channel))
+        if getattr(message, "reference", None) is None and not message.mentions:
+            cands -= self.addressed
+        if cands - self.phraseless:
+            allowed = set(self.phraseless)
+            for phrase in context.phrases:
+                allowed |= self.by_phrase.get(phrase, set())
+            cands &= allowed
+        return [self.filters[i] for i in sorted(cands)]
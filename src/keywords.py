@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+
+"""Single-pass matching of many literal phrases at once, shared by the keyword-triggered filters."""
+import re
+
+
+class KeywordMatcher:
+    """Set of literal phrases compiled into one regex, so a text is scanned once no matter how many
+    phrases are registered. Filters add the phrases they trigger on and then look them up in the
+    result of scan."""
+
+    def __init__(self, phrases=()):
+        self.phrases = set()
+        self.pattern = None
+        self.implied = {}
+        self.add(*phrases)
+
+    def add(self, *phrases):
+        """Registers phrases, recompiling the pattern on the next scan if any are new."""
+        new = set(phrases) - self.phrases
+        if new:
+            self.phrases |= new
+            self.pattern = None
+
+    def compile(self):
+        # the lookahead makes every match zero-width, so overlapping phrases are all found, and
+        # longest-first alternation makes the longest phrase win at each position
+        ordered = sorted(self.phrases, key=len, reverse=True)
+        self.pattern = re.compile("(?=(" + "|".join(map(re.escape, ordered)) + "))")
+        # a hit on a phrase is also a hit on every registered phrase it contains, which is how
+        # "thank" is reported when the alternation matched "thanks" at that position
+        self.implied = {
+            phrase: frozenset(other for other in self.phrases if other in phrase)
+            for phrase in self.phrases
+        }
+
+    def scan(self, text):
+        """Returns the set of registered phrases occurring in text."""
+        if not self.phrases:
+            return frozenset()
+        if self.pattern is None:
+            self.compile()
+        hits = set()
+        for match in self.pattern.finditer(text):
+            phrase = match.group(1)
+            if phrase not in hits:
+                hits |= self.implied[phrase]
+        return frozenset(hits)
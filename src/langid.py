@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+
+"""Deterministic language identification from a precomputed table of character n-gram
+log-probabilities, built offline from langdetect's language profiles.
+
+langdetect estimates a text's language by repeatedly sampling its n-grams at random, which is slow
+and gives different answers from run to run. This scores every n-gram of the text instead, as one
+NumPy gather and sum over a memory-mapped table, so the same text always gets the same answer.
+
+Build it ahead of time with python src/langid.py; it is also built on first load if missing.
+"""
+from collections import namedtuple
+import json
+import os
+import re
+import sys
+import numpy as np
+
+LANGID_DIR = "resources/langid"
+
+# langdetect's smoothing for n-grams a language's profile doesn't have: alpha / base frequency
+SMOOTHING = 0.5 / 10000
+# languages less probable than this are left out of the results, as langdetect does
+MIN_PROB = 0.1
+# summed log-likelihoods are divided by this before normalizing, since n-grams overlap and so aren't
+# independent evidence; without it nearly every guess has probability 1
+TEMPERATURE = 3.0
+
+URL_RE = re.compile(r"https?://[-_.?&~;+=/#0-9A-Za-z]{1,2076}")
+MAIL_RE = re.compile(r"[-_.0-9A-Za-z]{1,64}@[-_0-9A-Za-z]{1,255}[-_.0-9A-Za-z]{1,255}")
+
+Language = namedtuple("Language", ["lang", "prob"])
+
+
+def build(path=LANGID_DIR):
+    """Writes the n-gram table for langdetect's bundled profiles to path."""
+    import langdetect
+    from langdetect.utils.ngram import NGram
+
+    profile_dir = os.path.join(os.path.dirname(langdetect.__file__), "profiles")
+    profiles = [
+        json.load(open(os.path.join(profile_dir, name), encoding="utf-8"))
+        for name in sorted(os.listdir(profile_dir))
+    ]
+    grams = sorted(set().union(*(profile["freq"] for profile in profiles)))
+    index = {gram: i for i, gram in enumerate(grams)}
+    probs = np.zeros((len(grams), len(profiles)), dtype=np.float64)
+    for j, profile in enumerate(profiles):
+        for gram, count in profile["freq"].items():
+            probs[index[gram], j] = count / profile["n_words"][len(gram) - 1]
+    logprobs = np.log(probs + SMOOTHING).astype(np.float32)
+
+    # langdetect's per-character normalization, precomputed for the Basic Multilingual Plane
+    charmap = {}
+    for code in range(0x10000):
+        if 0xD800 <= code < 0xE000:
+            continue
+        normalized = NGram.normalize(chr(code))
+        if normalized != chr(code):
+            charmap[code] = normalized
+
+    os.makedirs(path, exist_ok=True)
+    np.save(os.path.join(path, "logprobs.npy"), logprobs)
+    with open(os.path.join(path, "grams.txt"), "w", encoding="utf-8") as f:
+        f.write("\n".join(grams) + "\n")
+    with open(os.path.join(path, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(
+            {
+                "langs": [profile["name"] for profile in profiles],
+                "langdetect_version": getattr(langdetect, "__version__", None),
+                "charmap": charmap,
+            },
+            f,
+        )
+
+
+def text_grams(text):
+    """The 1- to 3-grams langdetect draws from text, once each per occurrence. Words in capitals are
+    skipped, as acronyms and shouting say little about the language."""
+    grams = []
+    for word in text.split():
+        if len(word) > 1 and word.isupper():
+            continue
+        grams.extend(word)
+        padded = f" {word} "
+        grams.extend(padded[i : i + 2] for i in range(len(padded) - 1))
+        grams.extend(padded[i : i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+class NgramLanguageModel:
+    """Memory-mapped n-gram table written by build."""
+
+    def __init__(self, path=LANGID_DIR):
+        if not os.path.exists(os.path.join(path, "meta.json")):
+            build(path)
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        self.langs = meta["langs"]
+        self.charmap = {int(code): ch for code, ch in meta["charmap"].items()}
+        with open(os.path.join(path, "grams.txt"), encoding="utf-8") as f:
+            self.index = {gram: i for i, gram in enumerate(f.read().split("\n")[:-1])}
+        self.logprobs = np.load(os.path.join(path, "logprobs.npy"), mmap_mode="r")
+
+    def normalize(self, text):
+        text = MAIL_RE.sub(" ", URL_RE.sub(" ", text))
+        return text.translate(self.charmap)
+
+    def scores(self, text):
+        """Summed log-likelihood of text under each language, or None if it has no known n-grams."""
+        index = self.index
+        rows = [index[gram] for gram in text_grams(self.normalize(text)) if gram in index]
+        if not rows:
+            return None
+        return self.logprobs[np.array(rows)].sum(axis=0, dtype=np.float64)
+
+    def detect(self, text):
+        """Returns the languages of text as (lang, prob) pairs, most probable first."""
+        scores = self.scores(text)
+        if scores is None:
+            return []
+        scores = (scores - scores.max()) / TEMPERATURE
+        probs = np.exp(scores)
+        probs /= probs.sum()
+        order = np.argsort(-probs, kind="stable")
+        return [
+            Language(self.langs[i], float(probs[i])) for i in order if probs[i] > MIN_PROB
+        ]
+
+
+if __name__ == "__main__":
+    build()
+    model = NgramLanguageModel()
+    print(f"Built {len(model.index)} n-grams x {len(model.langs)} languages in {LANGID_DIR}")
+    for text in sys.argv[1:]:
+        print(text, model.detect(text))
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+
+"""In-process metrics: counters, gauges and latency histograms keyed by name and labels, summarized
+for the stats command and exported in the Prometheus text format."""
+from bisect import bisect_left
+import time
+
+# histogram bucket upper bounds in seconds: 10 µs to about two minutes, each a factor of √2 apart
+BUCKETS = tuple(1e-5 * 2 ** (i / 2) for i in range(48))
+
+
+class Counter:
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, n=1):
+        self.value += n
+
+
+class Histogram:
+    """Counts of observations in BUCKETS, from which quantiles are estimated to within a bucket."""
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """Estimates the q-th quantile by interpolating within the bucket it falls in."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if n and seen + n >= rank:
+                lower = BUCKETS[i - 1] if i > 0 else 0.0
+                upper = BUCKETS[i] if i < len(BUCKETS) else BUCKETS[-1]
+                return lower + (upper - lower) * (rank - seen) / n
+            seen += n
+        return BUCKETS[-1]
+
+
+class Timer:
+    """Context manager observing the time spent inside it, which may include awaits."""
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed = time.perf_counter() - self.start
+        self.histogram.observe(self.elapsed)
+
+
+class Metrics:
+    """Counters, gauges and histograms, created on first use. Each is identified by a name and a set of
+    labels, as in Prometheus: metrics.histogram("http_request_seconds", host="opentdb.com")."""
+
+    def __init__(self):
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+
+    @staticmethod
+    def key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def counter(self, name, **labels):
+        key = self.key(name, labels)
+        if key not in self.counters:
+            self.counters[key] = Counter()
+        return self.counters[key]
+
+    def histogram(self, name, **labels):
+        key = self.key(name, labels)
+        if key not in self.histograms:
+            self.histograms[key] = Histogram()
+        return self.histograms[key]
+
+    def timer(self, name, **labels):
+        return Timer(self.histogram(name, **labels))
+
+    def inc(self, name, n=1, **labels):
+        self.counter(name, **labels).inc(n)
+
+    def observe(self, name, value, **labels):
+        self.histogram(name, **labels).observe(value)
+
+    def set(self, name, value, **labels):
+        """Sets the gauge name to value."""
+        self.gauges[self.key(name, labels)] = value
+
+    def reset(self):
+        self.counters.clear()
+        self.gauges.clear()
+        self.histograms.clear()
+
+    @staticmethod
+    def series(name, labels, extra=()):
+        labels = tuple(labels) + tuple(extra)
+        if not labels:
+            return name
+        return name + "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+    def summary(self):
+        """Human-readable lines: count, p50 and p99 of each histogram, then each counter and
+        gauge."""
+        lines = []
+        for (name, labels), h in sorted(self.histograms.items()):
+            lines.append(
+                f"{self.series(name, labels)}: n={h.count} "
+                f"p50={h.quantile(0.5) * 1000:.2f}ms p99={h.quantile(0.99) * 1000:.2f}ms"
+            )
+        for (name, labels), c in sorted(self.counters.items()):
+            lines.append(f"{self.series(name, labels)}: {c.value}")
+        for (name, labels), value in sorted(self.gauges.items()):
+            lines.append(f"{self.series(name, labels)}: {value}")
+        return lines
+
+    def prometheus(self):
+        """Everything in the Prometheus text exposition format."""
+        lines = []
+        typed = set()
+        for (name, labels), c in sorted(self.counters.items()):
+            if name not in typed:
+                lines.append(f"# TYPE {name} counter")
+                typed.add(name)
+            lines.append(f"{self.series(name, labels)} {c.value}")
+        for (name, labels), value in sorted(self.gauges.items()):
+            if name not in typed:
+                lines.append(f"# TYPE {name} gauge")
+                typed.add(name)
+            lines.append(f"{self.series(name, labels)} {value}")
+        for (name, labels), h in sorted(self.histograms.items()):
+            if name not in typed:
+                lines.append(f"# TYPE {name} histogram")
+                typed.add(name)
+            cumulative = 0
+            bounds = [f"{bound:.6g}" for bound in BUCKETS] + ["+Inf"]
+            for bound, n in zip(bounds, h.counts):
+                cumulative += n
+                bucket = self.series(name + "_bucket", labels, [("le", bound)])
+                lines.append(f"{bucket} {cumulative}")
+            lines.append(f"{self.series(name + '_sum', labels)} {h.sum}")
+            lines.append(f"{self.series(name + '_count', labels)} {h.count}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+async def serve_prometheus(port, host="0.0.0.0"):
+    """Serves metrics.prometheus() at /metrics on port, returning the aiohttp runner."""
+    from aiohttp import web
+
+    async def handle(request):
+        return web.Response(text=metrics.prometheus(), content_type="text/plain")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+
+"""Shared asynchronous HTTP client used by the cogs, so that network calls never block the bot."""
+import aiohttp
+import asyncio
+import logging
+import random
+import time
+from urllib.parse import urlsplit
+from metrics import metrics
+
+
+class HTTPClient:
+    """Pooled aiohttp session shared by every cog. Connections are kept alive and capped per host,
+    requests time out, and connection errors, timeouts and 429/5xx responses are retried with
+    exponential backoff."""
+
+    RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+    def __init__(
+        self, limit=64, limit_per_host=8, timeout=10, retries=2, backoff=0.5
+    ):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.session = None
+
+    def get_session(self):
+        """Returns the shared session, creating it on first use inside the event loop."""
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit_per_host,
+                keepalive_timeout=30,
+            )
+            self.session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+        return self.session
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+
+    async def get(self, url, read, params=None, timeout=None):
+        """GETs url and returns await read(response). Raises aiohttp.ClientResponseError for error
+        statuses that are not retried or that are still failing after the last retry."""
+        kwargs = {"params": params}
+        host = urlsplit(url).netloc
+        if timeout is not None:
+            kwargs["timeout"] = aiohttp.ClientTimeout(total=timeout)
+        for attempt in range(self.retries + 1):
+            last = attempt == self.retries
+            delay = self.backoff * 2 ** attempt * random.uniform(0.5, 1.5)
+            start = time.perf_counter()
+            status = "error"
+            try:
+                async with self.get_session().get(url, **kwargs) as r:
+                    status = r.status
+                    if r.status not in self.RETRY_STATUSES or last:
+                        r.raise_for_status()
+                        return await read(r)
+                    if "Retry-After" in r.headers:
+                        try:
+                            delay = max(delay, float(r.headers["Retry-After"]))
+                        except ValueError:
+                            pass
+                    logging.info(
+                        "GET %s returned %d, retrying in %.2fs", url, r.status, delay
+                    )
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                if last:
+                    raise
+                logging.info("GET %s failed (%r), retrying in %.2fs", url, e, delay)
+            finally:
+                metrics.observe("http_request_seconds", time.perf_counter() - start, host=host)
+                metrics.inc("http_requests_total", host=host, status=status)
+            await asyncio.sleep(delay)
+
+    async def get_json(self, url, params=None, timeout=None):
+        # some APIs (opentdb) don't label their JSON as such, so skip the content type check
+        return await self.get(
+            url, lambda r: r.json(content_type=None), params=params, timeout=timeout
+        )
+
+    async def get_text(self, url, params=None, timeout=None):
+        return await self.get(url, lambda r: r.text(), params=params, timeout=timeout)
+
+
+http = HTTPClient()
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+
+"""Scheduler for outbound Discord actions (reactions and replies). Handlers queue actions and move
+on instead of waiting on Discord, and the scheduler sends them as fast as Discord's rate limits
+allow, so bursts are smoothed out rather than running into 429s."""
+import asyncio
+import bisect
+import itertools
+import logging
+import time
+from metrics import metrics
+from ratelimit import TokenBucket
+
+# lower goes first
+PRIORITY_MODERATION = 0
+PRIORITY_NORMAL = 1
+PRIORITY_FUN = 2
+
+# Discord's limits on each route in a single channel, as (actions per second, burst)
+ROUTE_LIMITS = {"reaction": (4, 1), "message": (1, 5)}
+# ...and on everything the bot sends, per second
+GLOBAL_RATE = 50
+
+
+class Action:
+    __slots__ = ("priority", "seq", "route", "channel_id", "key", "call", "submitted")
+
+    def __init__(self, priority, seq, route, channel_id, key, call):
+        self.priority = priority
+        self.seq = seq
+        self.route = route
+        self.channel_id = channel_id
+        self.key = key
+        self.call = call
+        self.submitted = time.perf_counter()
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class ActionScheduler:
+    """Queue of outbound actions, each sent once both its channel's bucket for its route and the
+    global bucket allow, most urgent first and otherwise in the order they were queued. An action
+    with the same key as one still queued (the same reaction on the same message, say) is dropped.
+    When max_pending actions are queued, the least urgent one is dropped to make room."""
+
+    def __init__(self, max_pending=1000, route_limits=ROUTE_LIMITS, global_rate=GLOBAL_RATE):
+        self.max_pending = max_pending
+        self.route_limits = route_limits
+        self.global_bucket = TokenBucket(global_rate)
+        # (route, channel id) -> TokenBucket
+        self.buckets = {}
+        # whether to respect the buckets at all; off when nothing real is being sent to
+        self.limited = True
+        # sorted most urgent first
+        self.queue = []
+        self.keys = set()
+        self.seq = itertools.count()
+        self.in_flight = set()
+        self.wakeup = None
+        self.worker = None
+        self.submitted = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.sent = 0
+        self.failed = 0
+
+    def start(self):
+        if self.worker is None or self.worker.done():
+            self.wakeup = asyncio.Event()
+            self.worker = asyncio.ensure_future(self.run())
+
+    def submit(self, route, channel_id, key, call, priority=PRIORITY_NORMAL):
+        """Queues call, a function of no arguments returning an awaitable, to be called when the
+        rate limits allow. Returns straight away, with whether the action was queued."""
+        if key in self.keys:
+            self.coalesced += 1
+            metrics.inc("outbound_coalesced_total", route=route)
+            return False
+        if len(self.queue) >= self.max_pending:
+            if self.queue[-1].priority <= priority:
+                self.drop(route)
+                return False
+            worst = self.queue.pop()
+            self.keys.discard(worst.key)
+            self.drop(worst.route)
+        bisect.insort(self.queue, Action(priority, next(self.seq), route, channel_id, key, call))
+        self.keys.add(key)
+        self.submitted += 1
+        metrics.set("outbound_queue_depth", len(self.queue))
+        self.start()
+        self.wakeup.set()
+        return True
+
+    def drop(self, route):
+        self.dropped += 1
+        metrics.inc("outbound_dropped_total", route=route)
+        logging.warning("Outbound queue full, dropping a %s", route)
+
+    def react(self, message, emoji, priority=PRIORITY_NORMAL):
+        """Queues a reaction to message."""
+        return self.submit(
+            "reaction",
+            message.channel.id,
+            ("reaction", message.id, str(emoji)),
+            lambda: message.add_reaction(emoji),
+            priority,
+        )
+
+    def reply(self, message, content, priority=PRIORITY_NORMAL):
+        """Queues a reply to message."""
+        return self.submit(
+            "message",
+            message.channel.id,
+            ("reply", message.id, content),
+            lambda: message.reply(content),
+            priority,
+        )
+
+    def bucket(self, route, channel_id):
+        key = (route, channel_id)
+        if key not in self.buckets:
+            self.buckets[key] = TokenBucket(*self.route_limits[route])
+        return self.buckets[key]
+
+    def next_ready(self):
+        """Takes the most urgent action that may be sent now off the queue and returns it with a
+        wait of 0, or returns None with the seconds until one may be sent (None if none is queued)."""
+        wait = None
+        for i, action in enumerate(self.queue):
+            if self.limited:
+                bucket = self.bucket(action.route, action.channel_id)
+                delay = max(bucket.delay(), self.global_bucket.delay())
+                if delay > 0:
+                    wait = delay if wait is None else min(wait, delay)
+                    continue
+                bucket.try_acquire()
+                self.global_bucket.try_acquire()
+            del self.queue[i]
+            self.keys.discard(action.key)
+            metrics.set("outbound_queue_depth", len(self.queue))
+            return action, 0
+        return None, wait
+
+    async def run(self):
+        while True:
+            action, wait = self.next_ready()
+            if action is None:
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            task = asyncio.ensure_future(self.send(action))
+            self.in_flight.add(task)
+            task.add_done_callback(self.in_flight.discard)
+
+    async def send(self, action):
+        metrics.observe(
+            "outbound_wait_seconds", time.perf_counter() - action.submitted, route=action.route
+        )
+        try:
+            with metrics.timer("outbound_call_seconds", route=action.route):
+                await action.call()
+            self.sent += 1
+        except Exception:
+            self.failed += 1
+            metrics.inc("outbound_failed_total", route=action.route)
+            logging.exception("Outbound %s failed", action.route)
+
+    async def drain(self):
+        """Waits until everything queued so far has been sent."""
+        while self.queue or self.in_flight:
+            if self.in_flight:
+                await asyncio.gather(*self.in_flight, return_exceptions=True)
+            else:
+                await asyncio.sleep(0.01)
+
+    def stats(self):
+        """Current queue depth and action counters."""
+        return {
+            "depth": len(self.queue),
+            "in_flight": len(self.in_flight),
+            "submitted": self.submitted,
+            "coalesced": self.coalesced,
+            "dropped": self.dropped,
+            "sent": self.sent,
+            "failed": self.failed,
+        }
+
+
+scheduler = ActionScheduler()
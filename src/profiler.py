@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+
+"""Sampling profiler for the running bot. A background thread samples the stack of the event loop's
+thread at a fixed interval and counts each distinct stack, writing them out as collapsed stacks
+(one "frame;frame;frame count" line each), which flamegraph.pl and speedscope read directly."""
+from collections import Counter
+import asyncio
+import os
+import sys
+import threading
+import time
+
+
+def frame_name(frame):
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+class SamplingProfiler:
+    """Samples the stack of thread_id (by default the calling thread) every interval seconds."""
+
+    def __init__(self, interval=0.005, thread_id=None):
+        self.interval = interval
+        self.thread_id = thread_id if thread_id is not None else threading.get_ident()
+        self.stacks = Counter()
+        self.samples = 0
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def sample(self):
+        frame = sys._current_frames().get(self.thread_id)
+        stack = []
+        while frame is not None:
+            stack.append(frame_name(frame))
+            frame = frame.f_back
+        if stack:
+            self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def loop(self):
+        while not self.stopped.wait(self.interval):
+            self.sample()
+
+    def start(self):
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.loop, name="profiler", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def collapsed(self):
+        """The samples as collapsed stacks, most frequent first."""
+        return "".join(f"{stack} {n}\n" for stack, n in self.stacks.most_common())
+
+    async def profile(self, seconds):
+        """Samples for the next seconds seconds, while the event loop carries on, and returns the
+        collapsed stacks."""
+        self.start()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            self.stop()
+        return self.collapsed()
+
+
+if __name__ == "__main__":
+    # profile a busy loop, as a smoke test: python src/profiler.py > busy.folded
+    profiler = SamplingProfiler()
+    profiler.start()
+    end = time.perf_counter() + 1
+    while time.perf_counter() < end:
+        sum(i * i for i in range(1000))
+    profiler.stop()
+    sys.stdout.write(profiler.collapsed())
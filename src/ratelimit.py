@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+
+"""Token buckets for keeping outbound Discord API traffic under its rate limits."""
+import asyncio
+import time
+
+
+class TokenBucket:
+    """Allows rate operations per second on average, in bursts of up to capacity."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self, n=1):
+        """Takes n tokens if they are available, returning whether it did."""
+        self.refill()
+        if self.tokens >= n:
+            self.tokens -= n
+            return True
+        return False
+
+    def delay(self, n=1):
+        """Seconds until n tokens will be available."""
+        self.refill()
+        return max(0.0, (n - self.tokens) / self.rate)
+
+    async def acquire(self, n=1):
+        """Waits until n tokens are available and takes them."""
+        while not self.try_acquire(n):
+            await asyncio.sleep(self.delay(n))
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+
+"""Sliding-window event counters in bounded memory, for filters that look at how often something
+happens (a user posting in a channel, someone being pinged) rather than at a single message.
+
+A window is split into buckets, so counts are exact to within one bucket's worth of time. Keys get
+their own ring of buckets up to a limit, and idle keys are forgotten once their whole window has
+passed; keys beyond the limit are counted together in a count-min sketch, which can only
+overestimate."""
+from collections import OrderedDict
+import numpy as np
+
+
+class Ring:
+    """Counts in the buckets of one key's window, with their total kept up to date."""
+
+    __slots__ = ("counts", "slot", "total")
+
+    def __init__(self, buckets, slot):
+        self.counts = [0] * buckets
+        self.slot = slot
+        self.total = 0
+
+    def advance(self, slot):
+        """Empties the buckets that have fallen out of the window by slot."""
+        buckets = len(self.counts)
+        if slot - self.slot >= buckets:
+            self.counts = [0] * buckets
+            self.total = 0
+        else:
+            for s in range(self.slot + 1, slot + 1):
+                self.total -= self.counts[s % buckets]
+                self.counts[s % buckets] = 0
+        self.slot = max(self.slot, slot)
+
+    def total_at(self, slot):
+        """What total would be after advance(slot), without advancing."""
+        buckets = len(self.counts)
+        if slot - self.slot >= buckets:
+            return 0
+        return self.total - sum(self.counts[s % buckets] for s in range(self.slot + 1, slot + 1))
+
+
+class CountMinSketch:
+    """Counts of any number of keys over a sliding window, in depth rows of width counters per
+    bucket. An estimate is never below the true count, and is above it by at most about
+    e / width of the window's total with probability 1 - exp(-depth)."""
+
+    def __init__(self, buckets, width=2048, depth=4):
+        self.width = width
+        self.depth = depth
+        self.counts = np.zeros((buckets, depth, width), dtype=np.int32)
+        self.totals = np.zeros((depth, width), dtype=np.int32)
+        self.rows = np.arange(depth)
+        self.slot = 0
+
+    def columns(self, key):
+        return np.array([hash((row, key)) % self.width for row in range(self.depth)])
+
+    def advance(self, slot):
+        buckets = len(self.counts)
+        if slot - self.slot >= buckets:
+            self.counts[:] = 0
+            self.totals[:] = 0
+        else:
+            for s in range(self.slot + 1, slot + 1):
+                self.totals -= self.counts[s % buckets]
+                self.counts[s % buckets] = 0
+        self.slot = max(self.slot, slot)
+
+    def add(self, key, slot, n=1):
+        columns = self.columns(key)
+        self.counts[slot % len(self.counts), self.rows, columns] += n
+        self.totals[self.rows, columns] += n
+        return int(self.totals[self.rows, columns].min())
+
+    def estimate(self, key):
+        return int(self.totals[self.rows, self.columns(key)].min())
+
+
+class RateCounter:
+    """Number of events per key in the last window seconds. Times are supplied by the caller (such
+    as message timestamps) and should not go backwards by more than a bucket. At most max_keys keys
+    are counted exactly; the rest share a count-min sketch."""
+
+    def __init__(self, window, buckets=12, max_keys=10000):
+        self.window = window
+        self.buckets = buckets
+        self.bucket_seconds = window / buckets
+        self.max_keys = max_keys
+        # key -> Ring, least recently added to first
+        self.rings = OrderedDict()
+        self.sketch = CountMinSketch(buckets)
+        self.sketched = 0
+
+    def clear(self):
+        self.rings.clear()
+        self.sketch = CountMinSketch(self.buckets)
+
+    def slot(self, now):
+        return int(now // self.bucket_seconds)
+
+    def expire(self, slot):
+        """Forgets keys with nothing left in their window."""
+        while self.rings:
+            ring = next(iter(self.rings.values()))
+            if slot - ring.slot < self.buckets:
+                break
+            self.rings.popitem(last=False)
+
+    def add(self, key, now, n=1):
+        """Counts n events for key at time now, returning the key's count in the window up to now."""
+        slot = self.slot(now)
+        self.expire(slot)
+        self.sketch.advance(slot)
+        ring = self.rings.get(key)
+        if ring is None:
+            if len(self.rings) >= self.max_keys:
+                self.sketched += 1
+                return self.sketch.add(key, slot, n)
+            ring = self.rings[key] = Ring(self.buckets, slot)
+            if self.sketched:
+                # the key may have been counted in the sketch while the table was full, so carry
+                # that over rather than letting its count start again
+                carried = self.sketch.estimate(key)
+                ring.counts[slot % self.buckets] += carried
+                ring.total += carried
+        else:
+            self.rings.move_to_end(key)
+        ring.advance(slot)
+        ring.counts[slot % self.buckets] += n
+        ring.total += n
+        return ring.total
+
+    def count(self, key, now):
+        """The key's count in the window up to now, without adding to it."""
+        slot = self.slot(now)
+        ring = self.rings.get(key)
+        if ring is None:
+            self.sketch.advance(slot)
+            return self.sketch.estimate(key)
+        return ring.total_at(slot)
+
+    def __len__(self):
+        return len(self.rings)
+
+    def stats(self):
+        return {"keys": len(self.rings), "max_keys": self.max_keys, "sketched": self.sketched}
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+
+"""Registry of expensive resources (models, tables, heavy libraries) that are loaded on first use
+instead of at import time, so the bot connects to Discord as quickly as possible."""
+import asyncio
+import importlib
+import logging
+import threading
+import time
+
+
+class LazyRegistry:
+    """Named resources, each loaded at most once: on first get, or ahead of time by warm. Load times
+    are logged and kept in timings."""
+
+    def __init__(self):
+        self.loaders = {}
+        self.values = {}
+        self.locks = {}
+        self.timings = {}
+
+    def register(self, name, loader):
+        """Registers loader, a function of no arguments, as the way to load name."""
+        self.loaders[name] = loader
+        self.locks[name] = threading.Lock()
+
+    def register_module(self, name, module=None):
+        """Registers a module to be imported on first use."""
+        self.register(name, lambda: importlib.import_module(module or name))
+
+    def loaded(self, name):
+        return name in self.values
+
+    def get(self, name):
+        """Returns the resource, loading it first if nobody has yet."""
+        if name not in self.values:
+            # several threads may ask at once when warming, but only one of them loads
+            with self.locks[name]:
+                if name not in self.values:
+                    start = time.perf_counter()
+                    self.values[name] = self.loaders[name]()
+                    self.timings[name] = time.perf_counter() - start
+                    logging.info("Loaded %s in %.0f ms", name, self.timings[name] * 1000)
+        return self.values[name]
+
+    async def warm(self, names=None):
+        """Loads the given resources (by default all of them) in background threads."""
+        loop = asyncio.get_running_loop()
+        names = [name for name in (names or self.loaders) if not self.loaded(name)]
+        results = await asyncio.gather(
+            *(loop.run_in_executor(None, self.get, name) for name in names),
+            return_exceptions=True,
+        )
+        for name, result in zip(names, results):
+            if isinstance(result, Exception):
+                logging.error("Failed to warm %s: %r", name, result)
+
+
+registry = LazyRegistry()
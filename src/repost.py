@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+
+"""Near-duplicate index over a sliding window of recent messages, for noticing the same message
+posted in several channels.
+
+Messages are summarized by MinHash signatures of their character shingles, and the signatures are
+split into bands that are looked up in hash tables (locality-sensitive hashing). A message is only
+compared with the earlier messages that share a band with it, never with the whole window. Old
+messages expire, and the window is cut short if it would exceed its memory budget.
+"""
+from collections import deque
+import zlib
+import numpy as np
+from constants import REPOST_WINDOW, REPOST_MEMORY
+
+# characters per shingle
+SHINGLE = 5
+# a signature has BANDS * ROWS minhashes; two messages become candidates if any band matches, which
+# is likely above a Jaccard similarity of about (1 / BANDS) ** (1 / ROWS) = 0.59
+BANDS = 8
+ROWS = 4
+NUM_PERM = BANDS * ROWS
+# memory per indexed message (its signature, band keys and bucket slots), as measured with tracemalloc
+ENTRY_BYTES = 2560
+
+# multiply-shift hash functions, one per permutation, fixed so signatures are reproducible
+_rng = np.random.default_rng(0)
+A = _rng.integers(1, 2 ** 63, NUM_PERM, dtype=np.uint64) | np.uint64(1)
+B = _rng.integers(0, 2 ** 63, NUM_PERM, dtype=np.uint64)
+
+
+def normalize(text):
+    return " ".join(text.lower().split())
+
+
+def signature(text):
+    """MinHash signature of the (normalized) text's character shingles."""
+    text = normalize(text)
+    shingles = {text[i : i + SHINGLE] for i in range(max(len(text) - SHINGLE + 1, 1))}
+    x = np.fromiter(
+        (zlib.crc32(s.encode("utf-8")) for s in shingles), dtype=np.uint64, count=len(shingles)
+    )
+    # uint64 arithmetic wraps around, which is what multiply-shift hashing wants; the top 32 bits
+    # are the hash
+    h = (A[:, None] * x[None, :] + B[:, None]) >> np.uint64(32)
+    return h.min(axis=1).astype(np.uint32)
+
+
+def similarity(a, b):
+    """Estimated Jaccard similarity of the shingles behind two signatures."""
+    return float(np.count_nonzero(a == b)) / NUM_PERM
+
+
+class Entry:
+    __slots__ = ("message_id", "channel_id", "channel_name", "time", "signature", "keys")
+
+    def __init__(self, message_id, channel_id, channel_name, time, signature, keys):
+        self.message_id = message_id
+        self.channel_id = channel_id
+        self.channel_name = channel_name
+        self.time = time
+        self.signature = signature
+        self.keys = keys
+
+
+class RepostIndex:
+    """Messages posted in the last window seconds, in LSH buckets scoped by a key (such as guild and
+    author) so that only messages in the same scope are ever compared. At most max_bytes worth of
+    messages are kept; beyond that the oldest go first."""
+
+    def __init__(self, window=REPOST_WINDOW, max_bytes=REPOST_MEMORY, threshold=0.7):
+        self.window = window
+        self.max_entries = max(1, max_bytes // ENTRY_BYTES)
+        self.threshold = threshold
+        # every entry, oldest first
+        self.entries = deque()
+        # (scope, band, band hashes) -> entries, oldest first; lists rather than deques since nearly
+        # all of them hold a single entry, and a deque's first block alone takes 600 bytes
+        self.buckets = {}
+        self.evicted = 0
+
+    def clear(self):
+        self.entries.clear()
+        self.buckets.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def expire(self, now):
+        """Drops entries older than the window, and the oldest entries beyond the budget."""
+        while self.entries and (
+            self.entries[0].time < now - self.window or len(self.entries) > self.max_entries
+        ):
+            entry = self.entries.popleft()
+            if entry.time >= now - self.window:
+                self.evicted += 1
+            # entries are added to their buckets and expired in the same order, so each is the
+            # oldest in every one of its buckets
+            for key in entry.keys:
+                bucket = self.buckets[key]
+                del bucket[0]
+                if not bucket:
+                    del self.buckets[key]
+
+    def find(self, channel_id, sig, keys):
+        """The most similar message in the scope posted in another channel, if it's similar
+        enough."""
+        best = None
+        best_similarity = 0.0
+        seen = set()
+        for key in keys:
+            for entry in self.buckets.get(key, ()):
+                if entry.channel_id == channel_id or entry.message_id in seen:
+                    continue
+                seen.add(entry.message_id)
+                s = similarity(sig, entry.signature)
+                # of equally similar messages, the earliest
+                if best is None or s > best_similarity or (
+                    s == best_similarity and best.time > entry.time
+                ):
+                    best, best_similarity = entry, s
+        return best if best_similarity >= self.threshold else None
+
+    def check(self, scope, message_id, channel_id, channel_name, text, now):
+        """Adds a message to the index, returning the Entry of an earlier near-duplicate of it in
+        the same scope but another channel, or None."""
+        self.expire(now)
+        sig = signature(text)
+        keys = tuple(
+            (scope, band, sig[band * ROWS : (band + 1) * ROWS].tobytes()) for band in range(BANDS)
+        )
+        match = self.find(channel_id, sig, keys)
+        entry = Entry(message_id, channel_id, channel_name, now, sig, keys)
+        self.entries.append(entry)
+        for key in keys:
+            self.buckets.setdefault(key, []).append(entry)
+        self.expire(now)
+        return match
+
+    def stats(self):
+        return {
+            "entries": len(self.entries),
+            "buckets": len(self.buckets),
+            "max_entries": self.max_entries,
+            "evicted": self.evicted,
+        }
+
+
+repost_index = RepostIndex()
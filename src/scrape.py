@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+
+"""Pipeline for scraping message history into training data. Several channels are read at once
+under a shared request budget, rows are streamed to disk in batches rather than held in memory, and
+each channel's progress is checkpointed so that a rerun only fetches messages it hasn't seen."""
+import asyncio
+import datetime
+import discord
+import logging
+import sqlite3
+from ratelimit import TokenBucket
+from utils import user_joined
+
+# discord.py fetches history in pages of this many messages, one API request each
+HISTORY_PAGE = 100
+# a channel's oldest scraped id once its backfill has reached the first message
+BACKFILL_DONE = 0
+
+
+class ScrapeState:
+    """On-disk record of the message ids already written and of each channel's newest and oldest
+    scraped messages, so dedupe and resumption cost no memory."""
+
+    def __init__(self, path):
+        self.db = sqlite3.connect(path)
+        self.db.execute("CREATE TABLE IF NOT EXISTS seen (id INTEGER PRIMARY KEY)")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS checkpoints "
+            "(channel_id INTEGER PRIMARY KEY, last_id INTEGER, oldest_id INTEGER)"
+        )
+        columns = [row[1] for row in self.db.execute("PRAGMA table_info(checkpoints)")]
+        if "oldest_id" not in columns:
+            # state from before backfills were resumed: they start over from the newest message
+            self.db.execute("ALTER TABLE checkpoints ADD COLUMN oldest_id INTEGER")
+        self.db.commit()
+
+    def unseen(self, rows):
+        """The rows whose ids haven't been recorded, recording them."""
+        ids = [row["id"] for row in rows]
+        placeholders = ",".join("?" * len(ids))
+        seen = {
+            i
+            for (i,) in self.db.execute(
+                f"SELECT id FROM seen WHERE id IN ({placeholders})", ids
+            )
+        }
+        new = [row for row in rows if row["id"] not in seen]
+        self.db.executemany("INSERT OR IGNORE INTO seen VALUES (?)", [(row["id"],) for row in new])
+        return new
+
+    def checkpoint(self, channel_id):
+        """The newest and oldest ids scraped from the channel, or None for either if there are none
+        yet. The oldest is BACKFILL_DONE once the channel's whole history has been read."""
+        row = self.db.execute(
+            "SELECT last_id, oldest_id FROM checkpoints WHERE channel_id = ?", (channel_id,)
+        ).fetchone()
+        return row if row else (None, None)
+
+    def set_checkpoint(self, channel_id, last_id, oldest_id):
+        self.db.execute(
+            "INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?)",
+            (channel_id, last_id, oldest_id),
+        )
+
+    def commit(self):
+        self.db.commit()
+
+
+class Scraper:
+    """Scrapes the history of several channels concurrently into a sink. At most max_channels
+    channels are read at once, and all of them share a budget of requests_per_second history
+    requests."""
+
+    def __init__(
+        self, sink, state, max_channels=4, requests_per_second=2.0, batch_size=500
+    ):
+        self.sink = sink
+        self.state = state
+        self.max_channels = max_channels
+        self.budget = TokenBucket(requests_per_second)
+        self.batch_size = batch_size
+        self.write_lock = asyncio.Lock()
+
+    @staticmethod
+    def to_row(msg, guild):
+        """The row for a message, or None if it shouldn't be kept: system messages and messages
+        sent more than an hour after their author joined."""
+        if msg.is_system():
+            return None
+        author = msg.author
+        joined = user_joined(guild.get_member(author.id))
+        if joined is not None and (msg.created_at - joined) > datetime.timedelta(hours=1):
+            return None
+        return {
+            "id": msg.id,
+            "content": msg.clean_content,
+            "server": msg.guild.name,
+            "channel": msg.channel.name,
+            "created": msg.created_at,
+            "author": author.name,
+            "author_created": author.created_at,
+            "author_joined": joined,
+        }
+
+    async def flush(self, channel, rows, last_id, oldest_id):
+        """Writes a batch of rows and then moves the channel's checkpoints past them."""
+        async with self.write_lock:
+            new = self.state.unseen(rows) if rows else []
+            if new:
+                self.sink.write(new)
+            self.state.set_checkpoint(channel.id, last_id, oldest_id)
+            self.state.commit()
+        return len(new)
+
+    async def fetch_page(self, channel, n, **kwargs):
+        """Up to n messages of channel's history, in a single request made within the budget."""
+        await self.budget.acquire()
+        return [msg async for msg in channel.history(limit=n, **kwargs)]
+
+    async def scrape_channel(self, channel, limit, slots):
+        """Reads up to limit messages of channel: first everything posted since the newest one
+        scraped, then further back from the oldest one, until the channel's first message."""
+        async with slots:
+            newest, oldest = self.state.checkpoint(channel.id)
+            logging.info("Scraping %s after %s and before %s", channel.name, newest, oldest)
+            num_msgs = 0
+            fetched = 0
+            rows = []
+            for forward in (True, False):
+                while fetched < limit:
+                    n = min(HISTORY_PAGE, limit - fetched)
+                    if forward:
+                        if newest is None:
+                            # nothing scraped yet, so the backfill starts from the newest
+                            break
+                        page = await self.fetch_page(
+                            channel, n, after=discord.Object(id=newest), oldest_first=True
+                        )
+                    else:
+                        if oldest == BACKFILL_DONE:
+                            break
+                        before = discord.Object(id=oldest) if oldest is not None else None
+                        page = await self.fetch_page(channel, n, before=before, oldest_first=False)
+                    fetched += len(page)
+                    ids = [msg.id for msg in page]
+                    if ids:
+                        newest = max(ids) if newest is None else max(newest, *ids)
+                        if not forward:
+                            oldest = min(ids) if oldest is None else min(oldest, *ids)
+                    if not forward and len(page) < n:
+                        oldest = BACKFILL_DONE
+                        # an empty channel: its first message will be found going forward
+                        newest = 0 if newest is None else newest
+                    for msg in page:
+                        row = self.to_row(msg, channel.guild)
+                        if row is not None:
+                            rows.append(row)
+                    if len(rows) >= self.batch_size:
+                        num_msgs += await self.flush(channel, rows, newest, oldest)
+                        rows = []
+                    if len(page) < n:
+                        break
+            num_msgs += await self.flush(channel, rows, newest, oldest)
+            logging.info("Scraped %d new messages from %s", num_msgs, channel.name)
+            return num_msgs
+
+    async def scrape(self, channels, limit=200):
+        """Scrapes up to limit messages from each channel, returning how many new rows it wrote."""
+        slots = asyncio.Semaphore(self.max_channels)
+        counts = await asyncio.gather(
+            *(self.scrape_channel(channel, limit, slots) for channel in channels)
+        )
+        return sum(counts)
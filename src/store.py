@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+
+"""Columnar message store for training and analysis data.
+
+Messages are kept as Parquet files partitioned by month, with int64 ids, typed timestamps and
+dictionary-encoded server, channel and author columns. New messages are appended as new files;
+compact merges each month's files into one and drops duplicates.
+
+    python src/store.py import processed_data.csv --label-column ask-to-ask
+    python src/store.py import data.csv messages.csv hour.csv test.csv
+    python src/store.py compact
+
+From a notebook: MessageStore().query(channels=["general"], label=1).to_pandas()
+"""
+import argparse
+import csv
+import datetime
+import os
+import uuid
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from constants import STORE_DIR
+
+SCHEMA = pa.schema(
+    [
+        ("id", pa.int64()),
+        ("content", pa.string()),
+        ("server", pa.string()),
+        ("channel", pa.string()),
+        ("created", pa.timestamp("us")),
+        ("author", pa.string()),
+        ("author_created", pa.timestamp("us")),
+        ("author_joined", pa.timestamp("us")),
+        # ask-to-ask label: 1 if it is one, 0 if it isn't, null if unlabeled
+        ("label", pa.int8()),
+    ]
+)
+# low-cardinality columns, dictionary-encoded on disk and in query results
+DICTIONARY_COLUMNS = ["server", "channel", "author"]
+
+
+def parse_time(value):
+    """Parses the timestamps written by pandas and by the scraper, passing datetimes through."""
+    if value is None or isinstance(value, datetime.datetime):
+        return value
+    return datetime.datetime.fromisoformat(value) if value else None
+
+
+def parse_id(value):
+    # ids went through floats in some spreadsheets (8.39695836320498E+017); that lost their low
+    # digits for good, but they still parse
+    return int(value) if str(value).isdigit() else int(float(value))
+
+
+class MessageStore:
+    """Partitioned, append-only Parquet store of messages rooted at root."""
+
+    def __init__(self, root=STORE_DIR):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def partition(self, month):
+        return os.path.join(self.root, f"month={month}")
+
+    def months(self):
+        return sorted(
+            name[len("month=") :] for name in os.listdir(self.root) if name.startswith("month=")
+        )
+
+    def files(self, months=None):
+        return [
+            os.path.join(self.partition(month), name)
+            for month in (months if months is not None else self.months())
+            if os.path.isdir(self.partition(month))
+            for name in sorted(os.listdir(self.partition(month)))
+            if name.endswith(".parquet")
+        ]
+
+    def write(self, rows):
+        """Appends rows (dicts with the scraper's fields, plus an optional label)."""
+        by_month = {}
+        for row in rows:
+            created = parse_time(row["created"])
+            by_month.setdefault(created.strftime("%Y-%m"), []).append(
+                {
+                    "id": parse_id(row["id"]),
+                    "content": row.get("content") or "",
+                    "server": row.get("server"),
+                    "channel": row.get("channel"),
+                    "created": created,
+                    "author": row.get("author"),
+                    "author_created": parse_time(row.get("author_created")),
+                    "author_joined": parse_time(row.get("author_joined")),
+                    "label": row.get("label"),
+                }
+            )
+        for month, month_rows in by_month.items():
+            table = pa.Table.from_pydict(
+                {name: [row[name] for row in month_rows] for name in SCHEMA.names},
+                schema=SCHEMA,
+            )
+            os.makedirs(self.partition(month), exist_ok=True)
+            self.write_file(table, os.path.join(self.partition(month), self.new_name()))
+
+    @staticmethod
+    def new_name():
+        return f"part-{datetime.datetime.utcnow():%Y%m%d%H%M%S}-{uuid.uuid4().hex[:8]}.parquet"
+
+    @staticmethod
+    def write_file(table, path):
+        # write then rename, so readers never see a half-written file
+        tmp = path + ".tmp"
+        pq.write_table(table, tmp, use_dictionary=DICTIONARY_COLUMNS, compression="zstd")
+        os.replace(tmp, path)
+
+    def query(self, channels=None, start=None, end=None, label=None, columns=None):
+        """Returns the messages in the given channels (all by default), created in [start, end),
+        with the given label, as an Arrow table."""
+        months = self.months()
+        if start is not None:
+            months = [m for m in months if m >= start.strftime("%Y-%m")]
+        if end is not None:
+            months = [m for m in months if m <= end.strftime("%Y-%m")]
+        files = self.files(months)
+        if not files:
+            return SCHEMA.empty_table()
+        conditions = []
+        if channels is not None:
+            conditions.append(ds.field("channel").isin(list(channels)))
+        if start is not None:
+            conditions.append(ds.field("created") >= pa.scalar(start, pa.timestamp("us")))
+        if end is not None:
+            conditions.append(ds.field("created") < pa.scalar(end, pa.timestamp("us")))
+        if label is not None:
+            conditions.append(ds.field("label") == label)
+        expression = None
+        for condition in conditions:
+            expression = condition if expression is None else expression & condition
+        table = ds.dataset(files, schema=SCHEMA, format="parquet").to_table(
+            columns=columns, filter=expression
+        )
+        for name in DICTIONARY_COLUMNS:
+            if name in table.column_names:
+                i = table.column_names.index(name)
+                table = table.set_column(i, name, table[name].dictionary_encode())
+        return table
+
+    def read(self):
+        """Yields every stored message as a dict, one file at a time."""
+        for path in self.files():
+            columns = pq.read_table(path).to_pydict()
+            for values in zip(*columns.values()):
+                yield dict(zip(columns, values))
+
+    def __len__(self):
+        return sum(pq.ParquetFile(path).metadata.num_rows for path in self.files())
+
+    def compact(self):
+        """Rewrites each month with more than one file as a single file sorted by creation time,
+        dropping duplicate messages. The most recently written copy of a message is kept, along
+        with the most recent label any copy of it had."""
+        for month in self.months():
+            paths = self.files([month])
+            if len(paths) <= 1:
+                continue
+            table = pa.concat_tables([pq.read_table(path) for path in paths])
+            # a message that went through a float has a different id than its other copies, so
+            # copies are also matched on when, by whom and what was sent
+            ids = table["id"].to_pylist()
+            messages = zip(
+                table["created"].to_pylist(),
+                table["author"].to_pylist(),
+                table["content"].to_pylist(),
+            )
+            labels = table["label"].to_pylist()
+            key_of_id = {}
+            last = {}
+            label = {}
+            for n, (i, message, lab) in enumerate(zip(ids, messages, labels)):
+                key = key_of_id.setdefault(i, message)
+                last[key] = n
+                if lab is not None:
+                    label[key] = lab
+            keys = {n: key for key, n in last.items()}
+            kept = sorted(keys)
+            table = table.take(kept)
+            table = table.set_column(
+                SCHEMA.names.index("label"),
+                "label",
+                pa.array([label.get(keys[n]) for n in kept], pa.int8()),
+            )
+            table = table.take(
+                pc.sort_indices(
+                    table, sort_keys=[("created", "ascending"), ("id", "ascending")]
+                )
+            )
+            self.write_file(table, os.path.join(self.partition(month), self.new_name()))
+            for path in paths:
+                os.remove(path)
+
+    def import_csv(self, path, label_column=None, batch_size=10000):
+        """Appends the messages in a CSV dump in the old pd.DataFrame.to_csv format."""
+        with open(path, newline="", encoding="utf-8") as f:
+            batch = []
+            for row in csv.DictReader(f):
+                if label_column is not None:
+                    value = row.get(label_column)
+                    row["label"] = int(float(value)) if value else None
+                batch.append(row)
+                if len(batch) >= batch_size:
+                    self.write(batch)
+                    batch = []
+            if batch:
+                self.write(batch)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage the Parquet message store.")
+    parser.add_argument("--root", default=STORE_DIR)
+    sub = parser.add_subparsers(dest="command", required=True)
+    import_parser = sub.add_parser("import", help="append CSV dumps to the store")
+    import_parser.add_argument("paths", nargs="+")
+    import_parser.add_argument("--label-column")
+    sub.add_parser("compact", help="merge each month's files and drop duplicate ids")
+    args = parser.parse_args()
+
+    store = MessageStore(args.root)
+    if args.command == "import":
+        for path in args.paths:
+            store.import_csv(path, args.label_column)
+    store.compact()
+    print(f"{len(store)} messages in {args.root}")
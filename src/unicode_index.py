@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+
+"""On-disk search index of Unicode character names, built offline from the unicodedata module.
+
+Names are indexed by whole word and by character trigram. A query collects the names sharing the
+most index keys with it and ranks just those with rapidfuzz, instead of scoring every name. All of
+the arrays are memory-mapped, so loading the index is nearly free.
+
+Build it ahead of time with python src/unicode_index.py; it is also built on first load if missing.
+"""
+from array import array
+from collections import Counter, defaultdict
+import json
+import mmap
+import os
+import re
+import sys
+import unicodedata
+from rapidfuzz import fuzz, process, utils
+
+INDEX_DIR = "resources/unicode_index"
+
+# names derived from the code point rather than listed individually in UnicodeData.txt
+DERIVED_NAME_PREFIXES = (
+    "CJK UNIFIED IDEOGRAPH-",
+    "TANGUT IDEOGRAPH-",
+    "KHITAN SMALL SCRIPT CHARACTER-",
+    "HANGUL SYLLABLE ",
+)
+# keys in more names than this are too common to narrow the search down, and are skipped
+MAX_POSTING = 1024
+# number of candidates ranked by rapidfuzz
+CANDIDATES = 64
+
+WORD_RE = re.compile(r"[A-Z0-9]+")
+
+
+def index_keys(name):
+    """The words and trigrams of a name (or an uppercased query)."""
+    words = WORD_RE.findall(name)
+    keys = set("w:" + word for word in words)
+    for word in words:
+        padded = f" {word} "
+        keys.update("t:" + padded[i : i + 3] for i in range(len(padded) - 2))
+    return keys
+
+
+def build(path=INDEX_DIR):
+    """Writes the index for this Python's Unicode database to path."""
+    os.makedirs(path, exist_ok=True)
+    codes = array("I")
+    names = []
+    for code in range(sys.maxunicode + 1):
+        name = unicodedata.name(chr(code), None)
+        if name is not None and not name.startswith(DERIVED_NAME_PREFIXES):
+            codes.append(code)
+            names.append(name)
+
+    postings = defaultdict(list)
+    for i, name in enumerate(names):
+        for key in index_keys(name):
+            postings[key].append(i)
+    keys = sorted(postings)
+
+    name_offsets = array("I", [0])
+    for name in names:
+        name_offsets.append(name_offsets[-1] + len(name) + 1)
+    key_offsets = array("I", [0])
+    flat = array("I")
+    for key in keys:
+        flat.extend(postings[key])
+        key_offsets.append(len(flat))
+
+    with open(os.path.join(path, "names.txt"), "w", encoding="ascii") as f:
+        f.write("\n".join(names) + "\n")
+    with open(os.path.join(path, "keys.txt"), "w", encoding="ascii") as f:
+        f.write("\n".join(keys) + "\n")
+    for fname, arr in (
+        ("codes.bin", codes),
+        ("name_offsets.bin", name_offsets),
+        ("key_offsets.bin", key_offsets),
+        ("postings.bin", flat),
+    ):
+        with open(os.path.join(path, fname), "wb") as f:
+            arr.tofile(f)
+    with open(os.path.join(path, "meta.json"), "w") as f:
+        json.dump({"unidata_version": unicodedata.unidata_version, "names": len(names)}, f)
+
+
+class UnicodeIndex:
+    """Memory-mapped index written by build."""
+
+    def __init__(self, path=INDEX_DIR):
+        meta_path = os.path.join(path, "meta.json")
+        if not os.path.exists(meta_path):
+            build(path)
+        else:
+            with open(meta_path) as f:
+                if json.load(f)["unidata_version"] != unicodedata.unidata_version:
+                    build(path)
+        self.maps = {}
+        self.all_names = None
+        self.names = self.map(path, "names.txt")
+        self.codes = self.map(path, "codes.bin").cast("I")
+        self.name_offsets = self.map(path, "name_offsets.bin").cast("I")
+        self.key_offsets = self.map(path, "key_offsets.bin").cast("I")
+        self.postings = self.map(path, "postings.bin").cast("I")
+        with open(os.path.join(path, "keys.txt"), encoding="ascii") as f:
+            self.keys = {key: i for i, key in enumerate(f.read().split("\n")[:-1])}
+
+    def map(self, path, fname):
+        with open(os.path.join(path, fname), "rb") as f:
+            self.maps[fname] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return memoryview(self.maps[fname])
+
+    def __len__(self):
+        return len(self.codes)
+
+    def name(self, i):
+        start, end = self.name_offsets[i], self.name_offsets[i + 1] - 1
+        return bytes(self.names[start:end]).decode("ascii")
+
+    def posting(self, key):
+        k = self.keys[key]
+        return self.postings[self.key_offsets[k] : self.key_offsets[k + 1]]
+
+    def candidates(self, query):
+        """Ids of the names sharing the most words and trigrams with query."""
+        keys = sorted(
+            (key for key in index_keys(query.upper()) if key in self.keys),
+            key=lambda key: len(self.posting(key)),
+        )
+        if not keys:
+            return []
+        # common keys add little but cost a lot to count, so use them only if nothing rarer exists
+        rare = [key for key in keys if len(self.posting(key)) <= MAX_POSTING] or keys[:1]
+        counts = Counter()
+        for key in rare:
+            counts.update(self.posting(key))
+        return [i for i, _ in counts.most_common(CANDIDATES)]
+
+    def search(self, query, limit=3):
+        """Returns (name, code point, score) for the limit names best matching query."""
+        ids = self.candidates(query)
+        if ids:
+            choices = {i: self.name(i) for i in ids}
+        else:
+            # nothing in common with any name, so fall back to scoring all of them
+            if self.all_names is None:
+                self.all_names = bytes(self.names).decode("ascii").split("\n")[:-1]
+            choices = self.all_names
+        results = process.extract(
+            query, choices, scorer=fuzz.WRatio, processor=utils.default_process, limit=limit
+        )
+        return [(name, self.codes[i], score) for name, score, i in results]
+
+
+if __name__ == "__main__":
+    build()
+    print(f"Built Unicode {unicodedata.unidata_version} name index in {INDEX_DIR}")
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+
+"""Pool of worker processes for CPU-bound NLP work, so that model inference and language detection
+run off the event loop and on more than one core."""
+import asyncio
+import concurrent.futures
+import logging
+import time
+from constants import (
+    A2A_BACKEND,
+    A2A_MODEL,
+    LANGDETECT_SEED,
+    NLP_WORKERS,
+    NLP_MAX_PENDING,
+    NLP_SATURATION_POLICY,
+)
+from registry import registry
+from metrics import metrics
+
+# how long a broken pool waits before starting new workers, so that workers which can never start
+# (such as when a model is missing) aren't restarted for every message
+RESTART_SECONDS = 30
+
+
+def load_a2a_nlp():
+    import spacy
+
+    return spacy.load(A2A_MODEL)
+
+
+def load_langdetect():
+    import langdetect
+    from langdetect.detector_factory import DetectorFactory, init_factory
+
+    init_factory()
+    DetectorFactory.seed = LANGDETECT_SEED
+    return langdetect
+
+
+def load_a2a_student():
+    from a2a_student import StudentClassifier
+
+    return StudentClassifier()
+
+
+# only ever loaded inside the workers, never in the bot process itself
+registry.register("a2a_nlp", load_a2a_nlp)
+registry.register("a2a_student", load_a2a_student)
+registry.register("langdetect", load_langdetect)
+A2A_COMPONENT = {"spacy": "a2a_nlp", "student": "a2a_student"}[A2A_BACKEND]
+
+
+def init_worker():
+    """Loads the models each worker needs, so no job pays for it."""
+    registry.get(A2A_COMPONENT)
+    registry.get("langdetect")
+
+
+def warm():
+    """No-op job, submitted once per worker to start it and run init_worker ahead of time."""
+    return registry.loaded(A2A_COMPONENT)
+
+
+def classify_batch(texts, batch_size):
+    """Returns the ask-to-ask category scores for each text."""
+    if A2A_BACKEND == "student":
+        return registry.get("a2a_student").cats(texts)
+    a2a_nlp = registry.get("a2a_nlp")
+    return [doc.cats for doc in a2a_nlp.pipe(texts, batch_size=batch_size)]
+
+
+def detect_languages(text):
+    """Returns langdetect's languages for text, most probable first."""
+    return registry.get("langdetect").detect_langs(text)
+
+
+class WorkerPool:
+    """Executor for CPU-bound jobs with backpressure. At most max_pending jobs are queued or running
+    at once; when the pool is saturated, run either returns None straight away (policy "skip") or
+    waits for a free slot (policy "wait"). If a worker dies or fails to start, the jobs it broke
+    return None too, as do any others for the next RESTART_SECONDS, after which new workers are
+    started."""
+
+    def __init__(self, workers, max_pending, policy="skip"):
+        if policy not in ("skip", "wait"):
+            raise ValueError(f"Unknown saturation policy {policy}")
+        self.workers = workers
+        self.max_pending = max_pending
+        self.policy = policy
+        self.executor = None
+        self.slots = None
+        self.depth = 0
+        self.max_depth = 0
+        self.waiting = 0
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.dropped = 0
+        self.restarts = 0
+        self.restart_at = 0.0
+
+    def start(self):
+        """Starts the workers and has each of them load its models."""
+        if self.executor is not None:
+            return
+        if self.workers > 0:
+            self.executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=self.workers,
+                initializer=init_worker,
+            )
+        else:
+            self.executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=1,
+                thread_name_prefix="nlp",
+                initializer=init_worker,
+            )
+        for _ in range(max(self.workers, 1)):
+            self.executor.submit(warm)
+
+    async def run(self, fn, *args):
+        """Runs fn(*args) in a worker and returns its result, or None if it was skipped because the
+        pool is saturated or broken."""
+        if self.executor is None and time.monotonic() < self.restart_at:
+            self.dropped += 1
+            metrics.inc("worker_jobs_dropped_total", job=fn.__name__)
+            return None
+        self.start()
+        if self.slots is None:
+            self.slots = asyncio.Semaphore(self.max_pending)
+        saturated = self.slots.locked()
+        if saturated and self.policy == "skip":
+            self.dropped += 1
+            metrics.inc("worker_jobs_dropped_total", job=fn.__name__)
+            logging.warning("NLP pool saturated, skipping %s", fn.__name__)
+            return None
+        self.waiting += saturated
+        try:
+            await self.slots.acquire()
+        finally:
+            self.waiting -= saturated
+        self.depth += 1
+        self.max_depth = max(self.max_depth, self.depth)
+        self.submitted += 1
+        executor = self.executor
+        try:
+            if executor is None:
+                # it broke while this job waited for a slot
+                self.dropped += 1
+                return None
+            loop = asyncio.get_running_loop()
+            with metrics.timer("worker_job_seconds", job=fn.__name__):
+                result = await loop.run_in_executor(executor, fn, *args)
+            self.completed += 1
+            return result
+        except concurrent.futures.BrokenExecutor as e:
+            self.failed += 1
+            self.restart(executor, e)
+            return None
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            self.depth -= 1
+            self.slots.release()
+
+    def restart(self, executor, error):
+        """Drops a broken executor, unless a job that broke with it already has, so that the next
+        job after RESTART_SECONDS starts new workers."""
+        if self.executor is not executor:
+            return
+        logging.error("NLP pool broke (%r), restarting it in %g s", error, RESTART_SECONDS)
+        metrics.inc("worker_pool_restarts_total")
+        self.restarts += 1
+        self.executor = None
+        self.restart_at = time.monotonic() + RESTART_SECONDS
+        executor.shutdown(wait=False)
+
+    def stats(self):
+        """Current queue depth and job counters."""
+        return {
+            "depth": self.depth,
+            "max_depth": self.max_depth,
+            "waiting": self.waiting,
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "dropped": self.dropped,
+            "restarts": self.restarts,
+        }
+
+
+pool = WorkerPool(NLP_WORKERS, NLP_MAX_PENDING, NLP_SATURATION_POLICY)